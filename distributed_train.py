@@ -6,8 +6,12 @@
 # the root directory of this source tree. An additional grant of patent rights
 # can be found in the PATENTS file in the same directory.
 
+import functools
 import os
 import signal
+import subprocess
+import sys
+import time
 
 import torch
 
@@ -15,6 +19,7 @@ from fairseq import distributed_utils, options
 from train import main as single_process_main
 
 
+@functools.lru_cache(maxsize=None)
 def _get_master_machine():
     mpi_host_file = os.path.expanduser('~/mpi-hosts')
     with open(mpi_host_file, 'r') as f:
@@ -22,86 +27,89 @@ def _get_master_machine():
     return master_name
 
 
+@functools.lru_cache(maxsize=None)
 def _get_master_ip(master_name=None):
     if master_name is None:
         master_name = _get_master_machine()
     etc_host_file = '/etc/hosts'
-    with open(etc_host_file, 'r') as f:
-        name_ip_pairs = f.readlines()
     name2ip = {}
-    for name_ip_pair in name_ip_pairs:
-        pair_list = name_ip_pair.split(' ')
-        key = pair_list[1].strip()
-        value = pair_list[0]
-        name2ip[key] = value
+    with open(etc_host_file, 'r') as f:
+        for line in f:
+            # entries are separated by arbitrary whitespace and may carry aliases
+            parts = line.split()
+            if len(parts) < 2 or parts[0].startswith('#'):
+                continue
+            for name in parts[1:]:
+                if name.startswith('#'):
+                    break
+                name2ip[name] = parts[0]
     return name2ip[master_name]
 
 
 def main(args):
+    if 'LOCAL_RANK' in os.environ:
+        # we are one of the workers started below
+        run(args)
+        return
+
     num_gpu = torch.cuda.device_count()
     host_world_size = int(os.environ.get('OMPI_COMM_WORLD_SIZE'))
     host_world_rank = int(os.environ.get('OMPI_COMM_WORLD_RANK'))
 
     assert int(os.environ.get('PHILLY_GPU_COUNT')) == num_gpu * host_world_size
-    args.distributed_world_size = int(os.environ.get('PHILLY_GPU_COUNT'))
-    args.distributed_init_method = f"tcp://{_get_master_ip()}:{args.distributed_port}"
 
-    mp = torch.multiprocessing.get_context('spawn')
-
-    error_queue = mp.SimpleQueue()
-    error_handler = ErrorHandler(error_queue)
+    # Start one fresh interpreter per GPU instead of spawning through
+    # torch.multiprocessing, so that args need not be pickled to the children.
+    env = os.environ.copy()
+    env['WORLD_SIZE'] = str(num_gpu * host_world_size)
+    if 'MASTER_ADDR' not in env:
+        # only fall back to the MPI host file if the launcher did not set it
+        env['MASTER_ADDR'] = _get_master_ip()
+    env['MASTER_PORT'] = str(args.distributed_port)
 
+    cmd = [sys.executable, '-u', sys.argv[0]] + sys.argv[1:]
     procs = []
     for i in range(num_gpu):
-        args.distributed_rank = host_world_rank * num_gpu + i
-        args.device_id = i
-        procs.append(mp.Process(target=run, args=(args, error_queue,), daemon=True))
-        procs[i].start()
-        error_handler.add_child(procs[i].pid)
-    for p in procs:
-        p.join()
-
-
-def run(args, error_queue):
+        env['RANK'] = str(host_world_rank * num_gpu + i)
+        env['LOCAL_RANK'] = str(i)
+        procs.append(subprocess.Popen(cmd, env=dict(env)))
+
+    # The workers are not daemons: stop them if this process is told to stop,
+    # and as soon as one of them fails, since the others would otherwise block
+    # in their next collective forever.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
     try:
-        args.distributed_rank = distributed_utils.distributed_init(args)
-        single_process_main(args)
-    except KeyboardInterrupt:
-        pass  # killed by parent, do nothing
-    except Exception:
-        # propagate exception to parent process, keeping original traceback
-        import traceback
-        error_queue.put((args.distributed_rank, traceback.format_exc()))
-
-
-class ErrorHandler(object):
-    """A class that listens for exceptions in children processes and propagates
-    the tracebacks to the parent process."""
-
-    def __init__(self, error_queue):
-        import signal
-        import threading
-        self.error_queue = error_queue
-        self.children_pids = []
-        self.error_thread = threading.Thread(target=self.error_listener, daemon=True)
-        self.error_thread.start()
-        signal.signal(signal.SIGUSR1, self.signal_handler)
-
-    def add_child(self, pid):
-        self.children_pids.append(pid)
-
-    def error_listener(self):
-        (rank, original_trace) = self.error_queue.get()
-        self.error_queue.put((rank, original_trace))
-        os.kill(os.getpid(), signal.SIGUSR1)
-
-    def signal_handler(self, signalnum, stackframe):
-        for pid in self.children_pids:
-            os.kill(pid, signal.SIGINT)  # kill children processes
-        (rank, original_trace) = self.error_queue.get()
-        msg = "\n\n-- Tracebacks above this line can probably be ignored --\n\n"
-        msg += original_trace
-        raise Exception(msg)
+        running = list(procs)
+        while len(running) > 0:
+            for p in list(running):
+                if p.poll() is None:
+                    continue
+                running.remove(p)
+                if p.returncode != 0:
+                    raise subprocess.CalledProcessError(returncode=p.returncode, cmd=cmd)
+            time.sleep(1)
+    finally:
+        for p in procs:
+            if p.poll() is None:
+                p.terminate()
+        for p in procs:
+            try:
+                p.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                p.kill()
+                p.wait()
+
+
+def run(args):
+    args.distributed_world_size = int(os.environ['WORLD_SIZE'])
+    args.distributed_rank = int(os.environ['RANK'])
+    args.device_id = int(os.environ['LOCAL_RANK'])
+    args.distributed_init_method = 'env://'
+
+    # bind this process to its GPU before NCCL creates its communicators
+    torch.cuda.set_device(args.device_id)
+    args.distributed_rank = distributed_utils.distributed_init(args)
+    single_process_main(args)
 
 
 if __name__ == '__main__':
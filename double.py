@@ -1,11 +1,15 @@
 import collections
+import copy
+import pickle
 import sys
 
 import torch
+from torch.serialization import default_restore_location
 
 
 def main():
-    ckpt = torch.load(sys.argv[1])
+    # keep everything on the host, so that saving does not copy tensors back from the GPU
+    ckpt = torch.load(sys.argv[1], map_location=lambda s, l: default_restore_location(s, 'cpu'))
 
     lst = []
     for k, v in ckpt['model'].items():
@@ -14,19 +18,19 @@ def main():
             l_id = int(k_split[2])
             k_split[2] = str(l_id + ckpt['args'].encoder_layers)
             new_k = '.'.join(k_split)
-            lst.append([new_k, v.clone()])
+            # no copy needed: torch.save writes a shared storage only once, and
+            # load_state_dict copies it into two independent parameters
+            lst.append([new_k, v])
     for k, v in lst:
         ckpt['model'][k] = v
 
     if len(sys.argv) > 3 and sys.argv[3] == '--double-optimizer':
         print('doubling the optimizer')
         new_optimizer_state = collections.OrderedDict()
-        new_optimizer_state['state'] = collections.OrderedDict()
         new_optimizer_state['param_groups'] = [collections.OrderedDict()]
         for k in ['betas', 'eps', 'weight_decay', 'amsgrad']:
             new_optimizer_state['param_groups'][0][k] = ckpt['last_optimizer_state']['param_groups'][0][k]
         new_optimizer_state['param_groups'][0]['lr'] = 1e-7
-        new_optimizer_state['param_groups'][0]['params'] = []
         head, layers, tail = [], [], []
         cnt = 0
         for k, v in ckpt['last_optimizer_state']['state'].items():
@@ -40,31 +44,19 @@ def main():
                 tail.append(v)
                 print(f"tail {v['exp_avg'].shape}")
             cnt += 1
-        cnt = 0
-        for it in head:
-            it['step'] = 0
-            new_optimizer_state['state'][cnt] = it
-            new_optimizer_state['param_groups'][0]['params'].append(cnt)
-            cnt += 1
-        for it in layers:
-            it['step'] = 0
-            new_optimizer_state['state'][cnt] = it
-            new_optimizer_state['param_groups'][0]['params'].append(cnt)
-            cnt += 1
-        for it in layers:
-            it['step'] = 0
-            new_optimizer_state['state'][cnt] = it
-            new_optimizer_state['param_groups'][0]['params'].append(cnt)
-            cnt += 1
-        for it in tail:
+        # the doubled layers get their own copy of the moments, otherwise both
+        # parameters would update the same exp_avg/exp_avg_sq in place
+        seq = head + layers + [copy.deepcopy(it) for it in layers] + tail
+        new_state = {}
+        for i, it in enumerate(seq):
             it['step'] = 0
-            new_optimizer_state['state'][cnt] = it
-            new_optimizer_state['param_groups'][0]['params'].append(cnt)
-            cnt += 1
+            new_state[i] = it
+        new_optimizer_state['state'] = new_state
+        new_optimizer_state['param_groups'][0]['params'] = list(range(len(seq)))
         ckpt['last_optimizer_state'] = new_optimizer_state
 
     ckpt['args'].encoder_layers *= 2
-    torch.save(ckpt, sys.argv[2])
+    torch.save(ckpt, sys.argv[2], pickle_protocol=pickle.HIGHEST_PROTOCOL)
 
 
 if __name__ == '__main__':
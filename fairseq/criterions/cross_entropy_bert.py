@@ -6,6 +6,7 @@
 # can be found in the PATENTS file in the same directory.
 
 import math
+import torch
 import torch.nn.functional as F
 
 from fairseq import utils
@@ -13,6 +14,24 @@ from fairseq import utils
 from . import FairseqCriterion, register_criterion
 
 
+def masked_lm_stats(lprobs, target, padding_idx, reduce=True):
+    """Compute the masked LM loss, the number of correct predictions and the
+    number of non-padding targets in one go.
+
+    Padding targets are ignored by all three statistics. The counts are
+    returned as tensors, so no device synchronization happens here.
+    """
+    pad_mask = target.eq(padding_idx)
+    nll_loss = -lprobs.gather(dim=-1, index=target.unsqueeze(-1)).squeeze(-1)
+    nll_loss = nll_loss.masked_fill(pad_mask, 0.)
+    if reduce:
+        nll_loss = nll_loss.sum()
+    not_pad = 1 - pad_mask.long()
+    n_correct = (lprobs.argmax(dim=-1).eq(target).long() * not_pad).sum().float()
+    n_valid = not_pad.sum()
+    return nll_loss, n_correct, n_valid
+
+
 @register_criterion('cross_entropy_bert')
 class CrossEntropyBertCriterion(FairseqCriterion):
 
@@ -36,74 +55,86 @@ class CrossEntropyBertCriterion(FairseqCriterion):
         mlm_lprobs = model.get_normalized_probs(mlm_out, log_probs=True)
         mlm_lprobs = mlm_lprobs.view(-1, mlm_lprobs.size(-1))
         target = model.get_targets(sample, mlm_out)[sample['net_input']['output_mask']].view(-1)
-        mlm_loss = F.nll_loss(mlm_lprobs, target, ignore_index=self.padding_idx, reduction='sum' if reduce else 'none')
-        mlm_acc = (mlm_lprobs.argmax(dim=-1).eq(target)).float().sum()
-        mlm_size = target.ne(self.padding_idx).long().sum().item()
+        mlm_loss, mlm_acc, mlm_size = masked_lm_stats(mlm_lprobs, target, self.padding_idx, reduce)
 
         nsp_out = nsp_out.float()
         label = model.get_label(sample)  # B
-        nsp_loss = F.binary_cross_entropy_with_logits(nsp_out, label.float(), reduction='sum' if reduce else 'none')
-        nsp_acc = ((nsp_out >= 0.0).eq(label.byte())).float().sum()
+        nsp_loss = F.binary_cross_entropy_with_logits(
+            nsp_out, label.type_as(nsp_out), reduction='sum' if reduce else 'none')
+        # count on the comparison mask directly and only cast the 0-d result
+        nsp_acc = nsp_out.ge(0.0).eq(label.bool()).sum().float()
 
         n_sentences = sample['target'].size(0)
 
         if self.enforce_idempotence:
             mlm_0_lprobs = model.get_normalized_probs(mlm_out_0, log_probs=True)
             mlm_0_lprobs = mlm_0_lprobs.view(-1, mlm_0_lprobs.size(-1))
-            source = sample['net_input']['src_tokens'][emb_mask].view(-1)
-            mlm_0_loss = F.nll_loss(mlm_0_lprobs, source, ignore_index=self.padding_idx,
-                                    reduction='sum' if reduce else 'none')
-            mlm_0_acc = (mlm_0_lprobs.argmax(dim=-1).eq(source)).float().sum()
-            mlm_0_size = source.ne(self.padding_idx).long().sum().item()
+            source = sample['net_input']['src_tokens'].t()[emb_mask.t()].view(-1)
+            mlm_0_loss, mlm_0_acc, mlm_0_size = masked_lm_stats(mlm_0_lprobs, source, self.padding_idx, reduce)
 
-            loss = mlm_loss + nsp_loss * mlm_size / n_sentences + mlm_0_loss * mlm_size / mlm_0_size
+            loss = mlm_loss + nsp_loss * mlm_size.float() / n_sentences \
+                + mlm_0_loss * mlm_size.float() / mlm_0_size.float()
         else:
-            loss = mlm_loss + nsp_loss * mlm_size / n_sentences
-
-        logging_output = {
-            'loss': utils.item(loss.data) if reduce else loss.data,
-            'mlm_loss': utils.item(mlm_loss.data) if reduce else mlm_loss.data,
-            'mlm_acc': utils.item(mlm_acc.data) if reduce else mlm_acc.data,
-            'nsp_loss': utils.item(nsp_loss.data) if reduce else nsp_loss.data,
-            'nsp_acc': utils.item(nsp_acc.data) if reduce else nsp_acc.data,
-            'ntokens': sample['ntokens'],
-            'nsentences': n_sentences,
-            'sample_size': mlm_size,
-        }
-
+            loss = mlm_loss + nsp_loss * mlm_size.float() / n_sentences
+
+        stats = [
+            ('loss', loss),
+            ('mlm_loss', mlm_loss),
+            ('mlm_acc', mlm_acc),
+            ('nsp_loss', nsp_loss),
+            ('nsp_acc', nsp_acc),
+            ('sample_size', mlm_size),
+        ]
         if self.enforce_idempotence:
-            logging_output['mlm_0_loss'] = utils.item(mlm_0_loss.data) if reduce else mlm_0_loss.data
-            logging_output['mlm_0_acc'] = utils.item(mlm_0_acc.data) if reduce else mlm_0_acc.data
-            logging_output['mlm_0_size'] = mlm_0_size
+            stats += [
+                ('mlm_0_loss', mlm_0_loss),
+                ('mlm_0_acc', mlm_0_acc),
+                ('mlm_0_size', mlm_0_size),
+            ]
+        if reduce:
+            # wait for the device only once, after the whole loss has been
+            # queued, and fetch every logged scalar in a single copy
+            values = torch.stack([v.data.float() for _, v in stats]).tolist()
+        else:
+            values = [v.data for _, v in stats]
+
+        logging_output = dict(zip((k for k, _ in stats), values))
+        for k in ['sample_size', 'mlm_0_size']:
+            if k in logging_output:
+                logging_output[k] = int(utils.item(logging_output[k]))
+        logging_output['ntokens'] = sample['ntokens']
+        logging_output['nsentences'] = n_sentences
 
-        return loss, mlm_size, logging_output
+        return loss, logging_output['sample_size'], logging_output
 
     @staticmethod
     def aggregate_logging_outputs(logging_outputs):
         """Aggregate logging outputs from data parallel training."""
-        loss_sum = sum(log.get('loss', 0) for log in logging_outputs)
-        mlm_loss_sum = sum(log.get('mlm_loss', 0) for log in logging_outputs)
-        mlm_acc_sum = sum(log.get('mlm_acc', 0) for log in logging_outputs)
-        nsp_loss_sum = sum(log.get('nsp_loss', 0) for log in logging_outputs)
-        nsp_acc_sum = sum(log.get('nsp_acc', 0) for log in logging_outputs)
-        ntokens = sum(log.get('ntokens', 0) for log in logging_outputs)
-        nsentences = sum(log.get('nsentences', 0) for log in logging_outputs)
-        sample_size = sum(log.get('sample_size', 0) for log in logging_outputs)
-        mlm_0_loss_sum = sum(log.get('mlm_0_loss', 0) for log in logging_outputs)
-        mlm_0_acc_sum = sum(log.get('mlm_0_acc', 0) for log in logging_outputs)
-        mlm_0_size_sum = sum(log.get('mlm_0_size', 0) for log in logging_outputs)
+        keys = (
+            'loss', 'mlm_loss', 'mlm_acc', 'nsp_loss', 'nsp_acc', 'ntokens', 'nsentences',
+            'sample_size', 'mlm_0_loss', 'mlm_0_acc', 'mlm_0_size',
+        )
+        tot = {k: 0 for k in keys}
+        for log in logging_outputs:
+            for k in keys:
+                v = log.get(k)
+                if v is not None:
+                    tot[k] += v
+        sample_size = tot['sample_size']
+        nsentences = tot['nsentences']
+        mlm_0_size_sum = tot['mlm_0_size']
         agg_output = {
-            'loss': loss_sum / sample_size,
-            'mlm_loss': mlm_loss_sum / sample_size,
-            'mlm_acc': mlm_acc_sum / sample_size,
-            'nsp_loss': nsp_loss_sum / nsentences,
-            'nsp_acc': nsp_acc_sum / nsentences,
-            'ntokens': ntokens,
+            'loss': tot['loss'] / sample_size,
+            'mlm_loss': tot['mlm_loss'] / sample_size,
+            'mlm_acc': tot['mlm_acc'] / sample_size,
+            'nsp_loss': tot['nsp_loss'] / nsentences,
+            'nsp_acc': tot['nsp_acc'] / nsentences,
+            'ntokens': tot['ntokens'],
             'nsentences': nsentences,
             'sample_size': sample_size,
         }
         if mlm_0_size_sum > 0:
-            agg_output['mlm_0_loss'] = mlm_0_loss_sum / mlm_0_size_sum
-            agg_output['mlm_0_acc'] = mlm_0_acc_sum / mlm_0_size_sum
+            agg_output['mlm_0_loss'] = tot['mlm_0_loss'] / mlm_0_size_sum
+            agg_output['mlm_0_acc'] = tot['mlm_0_acc'] / mlm_0_size_sum
             agg_output['mlm_0_size'] = mlm_0_size_sum
         return agg_output
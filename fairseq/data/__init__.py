@@ -7,7 +7,7 @@
 
 from .dictionary import Dictionary, TruncatedDictionary, BertDictionary
 from .fairseq_dataset import FairseqDataset
-from .indexed_dataset import IndexedDataset, IndexedInMemoryDataset, IndexedRawTextDataset
+from .indexed_dataset import IndexedDataset, IndexedInMemoryDataset, IndexedMMapDataset, IndexedRawTextDataset
 from .language_pair_dataset import LanguagePairDataset
 from .monolingual_dataset import MonolingualDataset
 from .bert_dataset import BertDataset
@@ -30,6 +30,7 @@ __all__ = [
     'GroupedIterator',
     'IndexedDataset',
     'IndexedInMemoryDataset',
+    'IndexedMMapDataset',
     'IndexedRawTextDataset',
     'LanguagePairDataset',
     'MonolingualDataset',
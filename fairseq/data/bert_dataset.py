@@ -99,7 +99,7 @@ class BertDataset(FairseqDataset):
             masked_lm_prob=0.15, mlm_mask_prob=0.8, mlm_random_prob=0.1
     ):
         self.src = src
-        self.src_sizes = np.array(src_sizes)
+        self.src_sizes = np.asarray(src_sizes)
         self.next_sent = None
         self.out_sizes = None
         self.src_dict = src_dict
@@ -7,8 +7,10 @@
 
 import contextlib
 import os
+import random
 
 import numpy as np
+import torch
 
 
 def infer_language_pair(path):
@@ -24,19 +26,20 @@ def infer_language_pair(path):
 def collate_tokens(values, pad_idx, eos_idx, left_pad, move_eos_to_beginning=False):
     """Convert a list of 1d tensors into a padded 2d tensor."""
     size = max(v.size(0) for v in values)
-    res = values[0].new(len(values), size).fill_(pad_idx)
-
-    def copy_tensor(src, dst):
-        assert dst.numel() == src.numel()
-        if move_eos_to_beginning:
-            assert src[-1] == eos_idx
-            dst[0] = eos_idx
-            dst[1:] = src[:-1]
-        else:
-            dst.copy_(src)
-
-    for i, v in enumerate(values):
-        copy_tensor(v, res[i][size - len(v):] if left_pad else res[i][:len(v)])
+    res = torch.nn.utils.rnn.pad_sequence(values, batch_first=True, padding_value=pad_idx)
+    if not left_pad and not move_eos_to_beginning:
+        return res
+
+    lengths = torch.tensor([v.size(0) for v in values], dtype=torch.long, device=res.device)
+    positions = torch.arange(size, dtype=torch.long, device=res.device).unsqueeze(0)
+    if move_eos_to_beginning:
+        assert res.gather(1, (lengths - 1).unsqueeze(1)).eq(eos_idx).all()
+        # shift every row right by one; the trailing eos moves to the front
+        res = torch.cat([res.new(len(values), 1).fill_(eos_idx), res[:, :-1]], dim=1)
+        res.masked_fill_(positions == lengths.unsqueeze(1), pad_idx)
+    if left_pad:
+        # rotate every row so that its padding ends up in front
+        res = res.gather(1, (positions + lengths.unsqueeze(1)) % size)
     return res
 
 
@@ -84,21 +87,26 @@ def filter_by_size(indices, size_fn, max_positions, raise_exception=False):
         raise_exception (bool, optional): if ``True``, raise an exception
             if any elements are filtered. Default: ``False``
     """
-    def check_size(idx):
-        if isinstance(max_positions, float) or isinstance(max_positions, int):
-            return size_fn(idx) <= max_positions
-        else:
+    indices = np.fromiter(indices, dtype=np.int64)
+    if isinstance(max_positions, float) or isinstance(max_positions, int):
+        # look up all sizes once and compare them in a single vectorized op
+        sizes = np.fromiter((size_fn(idx) for idx in indices), dtype=np.int64, count=len(indices))
+        valid = sizes <= max_positions
+    else:
+        def check_size(idx):
             return all(a is None or b is None or a <= b
                        for a, b in zip(size_fn(idx), max_positions))
 
-    ignored = []
-    itr = collect_filtered(check_size, indices, ignored)
-    for idx in itr:
-        if len(ignored) > 0 and raise_exception:
-            raise Exception((
-                'Size of sample #{} is invalid (={}) since max_positions={}, '
-                'skip this example with --skip-invalid-size-inputs-valid-test'
-            ).format(idx, size_fn(idx), max_positions))
+        valid = np.fromiter((check_size(idx) for idx in indices), dtype=bool, count=len(indices))
+
+    ignored = indices[~valid].tolist()
+    if len(ignored) > 0 and raise_exception:
+        raise Exception((
+            'Size of sample #{} is invalid (={}) since max_positions={}, '
+            'skip this example with --skip-invalid-size-inputs-valid-test'
+        ).format(ignored[0], size_fn(ignored[0]), max_positions))
+
+    for idx in indices[valid].tolist():
         yield idx
 
     if len(ignored) > 0:
@@ -108,10 +116,17 @@ def filter_by_size(indices, size_fn, max_positions, raise_exception=False):
         ).format(len(ignored), max_positions, ignored[:10]))
 
 
+def _sym_binomial(n):
+    """Draw from Binomial(n, 0.5), i.e. count the set bits of n random bits."""
+    if n <= 0:
+        return 0
+    return bin(random.getrandbits(n)).count('1')
+
+
 def _trunc_sent(sent, cnt):
-    trunc_head = np.random.binomial(cnt, 0.5)
+    trunc_head = _sym_binomial(cnt)
     trunc_tail = cnt - trunc_head
-    return sent[trunc_head:-trunc_tail]
+    return sent[trunc_head:sent.size(0) - trunc_tail]
 
 
 def truncate_single(sent, max_positions):
@@ -135,7 +150,7 @@ def truncate_pair(sent1, sent2, max_positions):
         diff -= to_trunc
     if diff <= 0:
         return sent1, sent2
-    trunc1 = np.random.binomial(diff, 0.5)
+    trunc1 = _sym_binomial(diff)
     trunc2 = diff - trunc1
     return _trunc_sent(sent1, trunc1), _trunc_sent(sent2, trunc2)
 
@@ -163,35 +178,35 @@ def batch_by_size(
     max_sentences = max_sentences if max_sentences is not None else float('Inf')
     bsz_mult = required_batch_size_multiple
 
-    batch = []
+    indices = np.fromiter(indices, dtype=np.int64)
+    sample_lens = np.fromiter(
+        (num_tokens_fn(idx) for idx in indices), dtype=np.int64, count=len(indices),
+    )
 
-    def is_batch_full(num_tokens):
-        if len(batch) == 0:
+    def is_batch_full(bsz, num_tokens):
+        if bsz == 0:
             return False
-        if len(batch) == max_sentences:
+        if bsz == max_sentences:
             return True
         if num_tokens > max_tokens:
             return True
         return False
 
+    # the current batch is indices[start:end]
+    start = 0
     sample_len = 0
-    sample_lens = []
-    ignored = []
-    for idx in indices:
-        sample_lens.append(num_tokens_fn(idx))
-        sample_len = max(sample_len, sample_lens[-1])
-        num_tokens = (len(batch) + 1) * sample_len
-        if is_batch_full(num_tokens):
+    for end in range(len(indices)):
+        sample_len = max(sample_len, sample_lens[end])
+        bsz = end - start
+        num_tokens = (bsz + 1) * sample_len
+        if is_batch_full(bsz, num_tokens):
             mod_len = max(
-                bsz_mult * (len(batch) // bsz_mult),
-                len(batch) % bsz_mult,
+                bsz_mult * (bsz // bsz_mult),
+                bsz % bsz_mult,
             )
-            yield batch[:mod_len]
-            batch = batch[mod_len:]
-            sample_lens = sample_lens[mod_len:]
-            sample_len = max(sample_lens) if len(sample_lens) > 0 else 0
-
-        batch.append(idx)
+            yield indices[start:start + mod_len].tolist()
+            start += mod_len
+            sample_len = sample_lens[start:end + 1].max()
 
-    if len(batch) > 0:
-        yield batch
+    if start < len(indices):
+        yield indices[start:].tolist()
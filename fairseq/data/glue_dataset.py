@@ -60,7 +60,7 @@ class GlueSingleDataset(FairseqDataset):
         left_pad=True, max_positions=384, shuffle=True
     ):
         self.src = src
-        self.src_sizes = np.array(src_sizes)
+        self.src_sizes = np.asarray(src_sizes)
         self.src_dict = src_dict
         self.left_pad = left_pad
         self.max_positions = max_positions
@@ -162,7 +162,7 @@ class GluePairDataset(FairseqDataset):
     ):
         self.src = src
         assert len(self.src) % 2 == 0
-        self.src_sizes = np.array(src_sizes)
+        self.src_sizes = np.asarray(src_sizes)
         self.src_dict = src_dict
         self.left_pad = left_pad
         self.max_positions = max_positions
@@ -124,7 +124,71 @@ class IndexedInMemoryDataset(IndexedDataset):
         self.check_index(i)
         tensor_size = self.sizes[self.dim_offsets[i]:self.dim_offsets[i + 1]]
         a = np.empty(tensor_size, dtype=self.dtype)
-        np.copyto(a, self.buffer[self.data_offsets[i]:self.data_offsets[i + 1]])
+        np.copyto(a, self.buffer[self.data_offsets[i]:self.data_offsets[i + 1]].reshape(tensor_size))
+        return torch.from_numpy(a).long()
+
+
+class MMapBuffer(object):
+    """Read-only view of the token stream in a ``.bin`` file.
+
+    The file is memory-mapped, so the OS pages in only the blocks that are
+    sliced, and the pages are shared by every process that maps the file.
+    Slices come back as regular arrays, shifted by *offset*. Pickling keeps
+    only the path, so the mapping is reopened in DataLoader workers rather
+    than copied into them.
+    """
+
+    def __init__(self, path, dtype, length, offset=0):
+        self.path = path
+        self.dtype = dtype
+        self.length = length
+        self.offset = offset
+        self._data = None
+
+    @property
+    def data(self):
+        if self._data is None:
+            if self.length == 0:
+                self._data = np.empty(0, dtype=self.dtype)
+            else:
+                self._data = np.memmap(self.path, dtype=self.dtype, mode='r', shape=(self.length,))
+        return self._data
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_data'] = None
+        return state
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, i):
+        item = np.array(self.data[i])
+        if self.offset != 0:
+            item += self.offset
+        return item
+
+
+class IndexedMMapDataset(IndexedDataset):
+    """Loader for TorchNet IndexedDataset, memory-maps the data file
+
+    Like :class:`IndexedInMemoryDataset` it exposes the whole token stream as
+    :attr:`buffer`, but nothing is read until it is indexed.
+    """
+
+    def read_data(self, path):
+        self.buffer = MMapBuffer(
+            data_file_path(path), self.dtype, int(self.data_offsets[-1]),
+            offset=-1 if self.fix_lua_indexing else 0,
+        )
+
+    def __del__(self):
+        pass
+
+    def __getitem__(self, i):
+        self.check_index(i)
+        tensor_size = self.sizes[self.dim_offsets[i]:self.dim_offsets[i + 1]]
+        a = self.buffer[self.data_offsets[i]:self.data_offsets[i + 1]].reshape(tensor_size)
         return torch.from_numpy(a).long()
 
 
@@ -27,18 +27,18 @@ class CountingIterator(object):
     def __init__(self, iterable):
         self.iterable = iterable
         self.count = 0
-        self.itr = iter(self)
+        self.itr = iter(iterable)
 
     def __len__(self):
         return len(self.iterable)
 
     def __iter__(self):
-        for x in self.iterable:
-            self.count += 1
-            yield x
+        return self
 
     def __next__(self):
-        return next(self.itr)
+        x = next(self.itr)
+        self.count += 1
+        return x
 
     def has_next(self):
         """Whether the iterator has been exhausted."""
@@ -47,6 +47,7 @@ class CountingIterator(object):
     def skip(self, num_to_skip):
         """Fast-forward the iterator by skipping *num_to_skip* elements."""
         next(itertools.islice(self.itr, num_to_skip, num_to_skip), None)
+        self.count += num_to_skip
         return self
 
 
@@ -72,23 +73,35 @@ class EpochBatchIterator(object):
             shards. Default: ``1``
         shard_id (int, optional): which shard of the data iterator to
             return. Default: ``0``
+        num_workers (int, optional): how many subprocesses to use for data
+            loading. The workers are started at the beginning of every epoch,
+            since datasets such as :class:`BertDataset` redraw their samples
+            in the main process between epochs. Default: ``0``
     """
 
-    def __init__(self, dataset, collate_fn, batch_sampler, seed=1, num_shards=1, shard_id=0):
+    def __init__(
+        self, dataset, collate_fn, batch_sampler, seed=1, num_shards=1, shard_id=0,
+        num_workers=0,
+    ):
         assert isinstance(dataset, torch.utils.data.Dataset)
         self.dataset = dataset
         self.collate_fn = collate_fn
-        self.frozen_batches = tuple(batch_sampler)
         self.seed = seed
         self.num_shards = num_shards
         self.shard_id = shard_id
+        self.num_workers = num_workers
+
+        # the DataLoader is built once and fed a new order of batches at the
+        # start of every epoch
+        self._epoch_batches = EpochBatchSampler(batch_sampler)
+        self._dataloader = None
 
         self.epoch = 0
         self._cur_epoch_itr = None
         self._next_epoch_itr = None
 
     def __len__(self):
-        return len(self.frozen_batches)
+        return self._epoch_batches.num_batches
 
     def next_epoch_itr(self, shuffle=True):
         """Return a new iterator over the dataset.
@@ -140,15 +153,69 @@ class EpochBatchIterator(object):
             # set seed based on the seed and epoch number so that we get
             # reproducible results when resuming from checkpoints
             with data_utils.numpy_seed(self.seed + epoch):
-                batches = list(self.frozen_batches)  # copy
-                np.random.shuffle(batches)
+                order = np.random.permutation(len(self))
         else:
-            batches = self.frozen_batches
-        return CountingIterator(torch.utils.data.DataLoader(
+            order = np.arange(len(self))
+        self._epoch_batches.set_order(
+            ShardedIterator(order, self.num_shards, self.shard_id, fill_value=-1)
+        )
+        if self._dataloader is None:
+            self._dataloader = self._build_dataloader()
+        return CountingIterator(self._dataloader)
+
+    def _build_dataloader(self):
+        kwargs = {}
+        if self.num_workers > 0:
+            kwargs['num_workers'] = self.num_workers
+            kwargs['pin_memory'] = torch.cuda.is_available()
+        return torch.utils.data.DataLoader(
             self.dataset,
             collate_fn=self.collate_fn,
-            batch_sampler=ShardedIterator(batches, self.num_shards, self.shard_id, fill_value=[]),
-        ))
+            batch_sampler=self._epoch_batches,
+            **kwargs
+        )
+
+
+class EpochBatchSampler(object):
+    """A batch sampler that yields frozen batches in an order which can be
+    replaced between epochs, so that a single
+    :class:`torch.utils.data.DataLoader` can be reused.
+
+    The batches are stored as one flat array of indices plus an array of
+    offsets rather than as a Python list per batch.
+
+    Args:
+        batch_sampler (~torch.utils.data.Sampler): an iterator over batches of
+            indices
+    """
+
+    def __init__(self, batch_sampler):
+        indices, sizes = [], []
+        for batch in batch_sampler:
+            indices.extend(batch)
+            sizes.append(len(batch))
+        self.indices = np.array(indices, dtype=np.int64)
+        self.offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=self.offsets[1:])
+        self.order = []
+
+    @property
+    def num_batches(self):
+        return len(self.offsets) - 1
+
+    def set_order(self, order):
+        """Set the batch ids to yield next; negative ids yield empty batches."""
+        self.order = order
+
+    def __len__(self):
+        return len(self.order)
+
+    def __iter__(self):
+        for i in self.order:
+            if i < 0:
+                yield []
+            else:
+                yield self.indices[self.offsets[i]:self.offsets[i + 1]].tolist()
 
 
 class GroupedIterator(object):
@@ -200,11 +267,9 @@ class ShardedIterator(object):
         if len(iterable) % num_shards > 0:
             self._sharded_len += 1
 
-        self.itr = itertools.zip_longest(
-            range(self._sharded_len),
-            itertools.islice(iterable, shard_id, len(iterable), num_shards),
-            fillvalue=fill_value,
-        )
+        self.itr = itertools.islice(iterable, shard_id, len(iterable), num_shards)
+        self.fill_value = fill_value
+        self._remaining = self._sharded_len
 
     def __len__(self):
         return self._sharded_len
@@ -213,4 +278,7 @@ class ShardedIterator(object):
         return self
 
     def __next__(self):
-        return next(self.itr)[1]
+        if self._remaining == 0:
+            raise StopIteration
+        self._remaining -= 1
+        return next(self.itr, self.fill_value)
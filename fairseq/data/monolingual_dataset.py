@@ -60,7 +60,7 @@ class MonolingualDataset(FairseqDataset):
     def __init__(self, dataset, sizes, src_vocab, tgt_vocab, add_eos_for_other_targets, shuffle,
                  targets=None):
         self.dataset = dataset
-        self.sizes = np.array(sizes)
+        self.sizes = np.asarray(sizes)
         self.vocab = src_vocab
         self.tgt_vocab = tgt_vocab
         self.add_eos_for_other_targets = add_eos_for_other_targets
@@ -118,7 +118,8 @@ class MonolingualDataset(FairseqDataset):
             def _filter(target):
                 mask = target.ge(len(self.tgt_vocab))
                 if mask.any():
-                    target[mask] = self.tgt_vocab.unk()
+                    # the target may share memory with the dataset's token buffer
+                    target = target.masked_fill(mask, self.tgt_vocab.unk())
                 return target
 
             if isinstance(target, list):
@@ -5,12 +5,18 @@
 # the root directory of this source tree. An additional grant of patent rights
 # can be found in the PATENTS file in the same directory.
 
-import math
+import bisect
 
 import numpy as np
 import torch
 
 
+def _as_long_tensor(a):
+    """Wrap a slice of the token buffer as a LongTensor. An int64 buffer is
+    shared rather than copied, so the result must not be modified in place."""
+    return torch.from_numpy(np.asarray(a, dtype=np.int64))
+
+
 class TokenBlockDataset(torch.utils.data.Dataset):
     """Break a 1d tensor of tokens into blocks.
 
@@ -37,49 +43,45 @@ class TokenBlockDataset(torch.utils.data.Dataset):
         self.pad = pad
         self.eos = eos
         self.include_targets = include_targets
-        self.slice_indices = []
 
         if break_mode is None or break_mode == 'none':
-            length = math.ceil(len(tokens) / block_size)
-
-            def block_at(i):
-                start = i * block_size
-                end = min(start + block_size, len(tokens))
-                return (start, end)
-
-            self.slice_indices = [block_at(i) for i in range(length)]
+            starts = np.arange(0, len(tokens), block_size)
+            ends = np.minimum(starts + block_size, len(tokens))
+            self.slice_indices = np.stack([starts, ends], axis=1)
         elif break_mode == 'complete':
-            assert sizes is not None and sum(sizes) == len(tokens), '{} != {}'.format(sum(sizes), len(tokens))
-            tok_idx = 0
-            sz_idx = 0
-            curr_size = 0
-            while sz_idx < len(sizes):
-                if curr_size + sizes[sz_idx] <= block_size or curr_size == 0:
-                    curr_size += sizes[sz_idx]
-                    sz_idx += 1
-                else:
-                    self.slice_indices.append((tok_idx, tok_idx + curr_size))
-                    tok_idx += curr_size
-                    curr_size = 0
-            if curr_size > 0:
-                self.slice_indices.append((tok_idx, tok_idx + curr_size))
+            assert sizes is not None and np.sum(sizes) == len(tokens), '{} != {}'.format(np.sum(sizes), len(tokens))
+            # greedily pack whole sentences, with one binary search per block
+            # over the sentence boundaries instead of a Python step per sentence
+            bounds = np.concatenate([[0], np.cumsum(sizes)]).tolist()
+            slice_indices = []
+            i = 0
+            while i < len(bounds) - 1:
+                start = bounds[i]
+                # the block holds at least the next non-empty sentence, even if
+                # that sentence alone exceeds block_size
+                first_end = i + 1 if bounds[i + 1] > start else bisect.bisect_right(bounds, start)
+                if first_end == len(bounds):
+                    break  # only empty sentences are left
+                j = bisect.bisect_right(bounds, max(start + block_size, bounds[first_end])) - 1
+                slice_indices.append((start, bounds[j]))
+                i = j
+            self.slice_indices = np.array(slice_indices, dtype=np.int64).reshape(-1, 2)
         elif break_mode == 'eos':
-            assert sizes is not None and sum(sizes) == len(tokens), '{} != {}'.format(sum(sizes), len(tokens))
-            curr = 0
-            for sz in sizes:
-                # skip samples with just 1 example (which would be just the eos token)
-                if sz > 1:
-                    self.slice_indices.append((curr, curr + sz))
-                curr += sz
+            assert sizes is not None and np.sum(sizes) == len(tokens), '{} != {}'.format(np.sum(sizes), len(tokens))
+            ends = np.cumsum(sizes)
+            starts = ends - sizes
+            # skip samples with just 1 example (which would be just the eos token)
+            keep = np.asarray(sizes) > 1
+            self.slice_indices = np.stack([starts[keep], ends[keep]], axis=1)
         else:
             raise ValueError('Invalid break_mode: ' + break_mode)
 
-        self.sizes = np.array([e - s for s, e in self.slice_indices])
+        self.sizes = self.slice_indices[:, 1] - self.slice_indices[:, 0]
 
     def __getitem__(self, index):
         s, e = self.slice_indices[index]
 
-        item = torch.LongTensor(self.tokens[s:e])
+        item = _as_long_tensor(self.tokens[s:e])
 
         if self.include_targets:
             # target is the sentence, for source, rotate item one token to the left (would start with eos)
@@ -94,7 +96,7 @@ class TokenBlockDataset(torch.utils.data.Dataset):
                 else:
                     past_target = self.tokens[s - 2:e - 2]
 
-            return torch.LongTensor(source), item, torch.LongTensor(past_target)
+            return _as_long_tensor(source), item, _as_long_tensor(past_target)
         return item
 
     def __len__(self):
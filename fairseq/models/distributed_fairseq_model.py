@@ -5,6 +5,8 @@
 # the root directory of this source tree. An additional grant of patent rights
 # can be found in the PATENTS file in the same directory.
 
+import contextlib
+
 from torch.nn import parallel
 
 from fairseq.distributed_utils import c10d_status
@@ -60,6 +62,15 @@ class DistributedFairseqModel(BaseFairseqModel):
         else:
             raise ValueError('Unknown --ddp-backend: ' + args.ddp_backend)
 
+    def no_sync(self):
+        """Context manager that skips the gradient all-reduce for the
+        forward/backward passes run inside it."""
+        if hasattr(self.ddp_model, 'no_sync'):
+            return self.ddp_model.no_sync()
+        # older DistributedDataParallel implementations look at this flag
+        self.ddp_model.need_reduction = False
+        return _restore_need_reduction(self.ddp_model)
+
     def __call__(self, *args, **kwargs):
         return self.ddp_model(*args, **kwargs)
 
@@ -76,3 +87,11 @@ class DistributedFairseqModel(BaseFairseqModel):
         except AttributeError:
             pass
         return self.ddp_model.module.__getattr__(name)
+
+
+@contextlib.contextmanager
+def _restore_need_reduction(ddp_model):
+    try:
+        yield
+    finally:
+        ddp_model.need_reduction = True
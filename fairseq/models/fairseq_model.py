@@ -38,14 +38,16 @@ class BaseFairseqModel(nn.Module):
 
     def get_normalized_probs(self, net_output, log_probs, sample=None):
         """Get normalized probabilities (or log probs) from a net's output."""
-        if hasattr(self, 'decoder'):
-            return self.decoder.get_normalized_probs(net_output, log_probs, sample)
-        elif torch.is_tensor(net_output):
-            logits = net_output.float()
+        # check the cheap case first: hasattr on a module without a decoder
+        # has to go through nn.Module.__getattr__ and a raised AttributeError
+        if torch.is_tensor(net_output):
+            # upcast inside the kernel rather than materializing a float copy
             if log_probs:
-                return F.log_softmax(logits, dim=-1)
+                return F.log_softmax(net_output, dim=-1, dtype=torch.float32)
             else:
-                return F.softmax(logits, dim=-1)
+                return F.softmax(net_output, dim=-1, dtype=torch.float32)
+        elif hasattr(self, 'decoder'):
+            return self.decoder.get_normalized_probs(net_output, log_probs, sample)
         raise NotImplementedError
 
     def max_positions(self):
@@ -73,40 +75,59 @@ class BaseFairseqModel(nn.Module):
     def upgrade_state_dict_named(self, state_dict, name):
         assert state_dict is not None
 
-        def do_upgrade(m, prefix):
-            if len(prefix) > 0:
-                prefix += '.'
-
-            for n, c in m.named_children():
-                name = prefix + n
-                if hasattr(c, 'upgrade_state_dict_named'):
-                    c.upgrade_state_dict_named(state_dict, name)
-                elif hasattr(c, 'upgrade_state_dict'):
-                    c.upgrade_state_dict(state_dict)
-                do_upgrade(c, name)
-
-        do_upgrade(self, name)
-
-    def make_generation_fast_(self, **kwargs):
-        """Optimize model for faster generation."""
+        prefix = name + '.' if len(name) > 0 else ''
+        for n, m in list(self.named_modules()):
+            if m is self:
+                continue
+            if hasattr(m, 'upgrade_state_dict_named'):
+                m.upgrade_state_dict_named(state_dict, prefix + n)
+            elif hasattr(m, 'upgrade_state_dict'):
+                m.upgrade_state_dict(state_dict)
+
+    def make_generation_fast_(self, quantize=False, bf16=False, **kwargs):
+        """Optimize model for faster generation.
+
+        If *quantize* is ``True``, all :class:`nn.Linear` modules are replaced
+        by dynamically quantized int8 versions. Modules that project onto the
+        vocabulary with a bare weight can expose it as a linear layer first
+        by implementing ``prepare_for_quantization_``. This is only supported
+        for models that are run on the CPU.
+
+        If *bf16* is ``True``, the forward pass runs under bfloat16 autocast
+        on whichever device the model ends up on. Parameters are kept in
+        their original precision.
+        """
         if self._is_generation_fast:
             return  # only apply once
         self._is_generation_fast = True
 
+        # walk the module tree only once
+        modules = list(self.modules())
+
         # remove weight norm from all modules in the network
-        def apply_remove_weight_norm(module):
+        for module in modules:
             try:
                 nn.utils.remove_weight_norm(module)
             except ValueError:  # this module didn't have weight norm
-                return
+                continue
 
-        self.apply(apply_remove_weight_norm)
-
-        def apply_make_generation_fast_(module):
-            if module != self and hasattr(module, 'make_generation_fast_'):
+        for module in modules:
+            if module is not self and hasattr(module, 'make_generation_fast_'):
                 module.make_generation_fast_(**kwargs)
 
-        self.apply(apply_make_generation_fast_)
+        if quantize:
+            if not hasattr(torch, 'quantization') or not hasattr(torch.quantization, 'quantize_dynamic'):
+                raise RuntimeError('int8 quantization requires a newer version of PyTorch')
+            self.eval()
+            for module in modules:
+                if hasattr(module, 'prepare_for_quantization_'):
+                    module.prepare_for_quantization_()
+            torch.quantization.quantize_dynamic(self, {nn.Linear}, dtype=torch.qint8, inplace=True)
+
+        if bf16:
+            if not hasattr(torch, 'autocast'):
+                raise RuntimeError('bf16 autocast requires a newer version of PyTorch')
+            self.forward = self._forward_bf16
 
         def train(mode):
             if mode:
@@ -116,6 +137,11 @@ class BaseFairseqModel(nn.Module):
         self.eval()
         self.train = train
 
+    def _forward_bf16(self, *args, **kwargs):
+        device_type = next(self.parameters()).device.type
+        with torch.autocast(device_type, dtype=torch.bfloat16):
+            return type(self).forward(self, *args, **kwargs)
+
     def prepare_for_onnx_export_(self, **kwargs):
         """Make model exportable via ONNX trace."""
         def apply_prepare_for_onnx_export_(module):
@@ -166,39 +192,143 @@ class FairseqModel(BaseFairseqModel):
         decoder_out = self.decoder(prev_output_tokens, encoder_out)
         return decoder_out
 
+    def get_normalized_probs(self, net_output, log_probs, sample=None):
+        """Get normalized probabilities (or log probs) from a net's output."""
+        return self.decoder.get_normalized_probs(net_output, log_probs, sample)
+
     def max_positions(self):
         """Maximum length supported by the model."""
         return (self.encoder.max_positions(), self.decoder.max_positions())
 
 
 class FairseqBertModel(BaseFairseqModel):
-    def __init__(self, encoder, mid_layer, embed_out, feature_dim, enforce_idempotence=False):
+    def __init__(self, encoder, mid_layer, embed_out, feature_dim, enforce_idempotence=False,
+                 padding_idx=1, mlm_prob=0.15):
         super().__init__()
         self.encoder = encoder
         self.mid_layer = mid_layer
         self.embed_out = embed_out
         self.classifier = nn.Linear(feature_dim, 1)
         self.enforce_idempotence = enforce_idempotence
+        self.padding_idx = padding_idx
+        self.mlm_prob = mlm_prob
+        self.output_projection = None
         assert isinstance(self.encoder, FairseqEncoder)
 
     def forward(self, src_tokens, src_lengths, segment, output_mask):
-        encoder_return_value = self.encoder(src_tokens, src_lengths, segment, output_mask)
+        if self.enforce_idempotence and not self._is_generation_fast:
+            return self._forward_train(src_tokens, src_lengths, segment, output_mask)
+        return self._forward_infer(src_tokens, src_lengths, segment, output_mask)
+
+    def _forward_infer(self, src_tokens, src_lengths, segment, output_mask):
+        bsz = src_tokens.size(0)
+        encoder_out = self.encode(src_tokens, src_lengths, segment, output_mask)['encoder_out']  # (B + N) x C
+        return self.mlm(encoder_out, bsz), self.nsp(encoder_out, bsz)
+
+    def _forward_train(self, src_tokens, src_lengths, segment, output_mask):
+        bsz = src_tokens.size(0)
+        encoder_return_value = self.encode(src_tokens, src_lengths, segment, output_mask, return_embedding_out=True)
         encoder_out = encoder_return_value['encoder_out']  # (B + N) x C
-        mlm_out = F.linear(self.mid_layer(encoder_out[src_tokens.size(0):]), self.embed_out)  # N x V
-        nsp_out = self.classifier(encoder_out[:src_tokens.size(0)]).view(-1)  # B
-        if self.enforce_idempotence:
-            embedding_out = encoder_return_value['embedding_out']  # T x B x C
-            # TODO: 1 => padding_idx ; 0.15 => masked_lm_prob
-            emb_mask = (src_tokens != 1) & (torch.rand_like(src_tokens, dtype=torch.float) < 0.15)
-            mlm_out_0 = F.linear(self.mid_layer(embedding_out.transpose(0, 1)[emb_mask]), self.embed_out)  # M x V
-            return mlm_out, nsp_out, mlm_out_0, emb_mask
-        else:
-            return mlm_out, nsp_out
+        mlm_out = self.mlm(encoder_out, bsz)  # N x V
+        nsp_out = self.nsp(encoder_out, bsz)  # B
+        embedding_out = encoder_return_value['embedding_out']  # T x B x C
+        # draw the mask directly in the dtype of the comparison instead of
+        # thresholding a float tensor of uniform samples
+        emb_mask = src_tokens.ne(self.padding_idx)
+        emb_mask &= torch.empty_like(emb_mask).bernoulli_(self.mlm_prob)
+        # index the time-major activations with the (much smaller) transposed
+        # mask, so the rows of mlm_out_0 follow the order of emb_mask.t()
+        mlm_out_0 = self._mlm_head(embedding_out[emb_mask.t()])  # M x V
+        return mlm_out, nsp_out, mlm_out_0, emb_mask
+
+    def encode(self, src_tokens, src_lengths, segment, output_mask, return_embedding_out=False):
+        """Run the encoder only.
+
+        The returned dict can be cached and fed to :func:`mlm` and :func:`nsp`
+        any number of times without recomputing the encoder. Its
+        ``encoder_out`` holds the B sentence features followed by the N
+        masked positions, i.e. it has shape `(B + N, C)`. ``embedding_out``
+        is only computed if *return_embedding_out* is set.
+        """
+        return self.encoder(src_tokens, src_lengths, segment, output_mask, return_embedding_out=return_embedding_out)
+
+    def mlm(self, encoder_out, batch_size):
+        """Masked LM logits of shape `(N, V)` from a cached *encoder_out*."""
+        return self._mlm_head(encoder_out[batch_size:])
+
+    def nsp(self, encoder_out, batch_size):
+        """Next sentence prediction logits of shape `(B,)` from a cached
+        *encoder_out*."""
+        return self._nsp_head(encoder_out[:batch_size])
+
+    def get_heads(self):
+        """Return the masked LM and next sentence prediction heads as a
+        standalone :class:`BertHeads` module that calls into this model.
+
+        The heads can be exported with :func:`torch.onnx.export` (after
+        :func:`prepare_for_onnx_export_`) and fed with encoder outputs
+        computed by :func:`encode`, either live or from a cache.
+        """
+        return BertHeads(self)
+
+    def _nsp_head(self, features):
+        """Project the sentence features (B x C) to next sentence prediction
+        logits (B,)."""
+        return self.classifier(features).squeeze(-1)
+
+    def _mlm_head(self, features):
+        """Project the features of the masked positions (N x C) to vocabulary
+        logits (N x V). *features* is used as given, so passing a slice of the
+        encoder output avoids gathering the rows into a new tensor first."""
+        if self.output_projection is not None:
+            return self.output_projection(self.mid_layer(features))
+        return F.linear(self.mid_layer(features), self.embed_out)
+
+    def prepare_for_quantization_(self):
+        """Wrap *embed_out* in an :class:`nn.Linear`, so that the masked LM
+        projection gets quantized along with the other linear layers."""
+        self.output_projection = nn.Linear(self.embed_out.size(1), self.embed_out.size(0), bias=False)
+        self.output_projection.weight = self.embed_out
 
     def max_positions(self):
         return self.encoder.max_positions()
 
 
+class BertHeads(nn.Module):
+    """The output heads of a :class:`FairseqBertModel`.
+
+    The heads hold no weights of their own and call the model's heads
+    directly, so they keep matching :func:`FairseqBertModel.mlm` and
+    :func:`FairseqBertModel.nsp` after the model is prepared for
+    quantization or quantized.
+
+    Args:
+        model (FairseqBertModel): the model whose heads to wrap
+    """
+
+    def __init__(self, model):
+        super().__init__()
+        # a tuple is not registered as a submodule, so the heads do not pull
+        # the encoder into their parameters and state dict
+        self._model = (model,)
+
+    def forward(self, nsp_features, mlm_features):
+        """
+        Args:
+            nsp_features (Tensor): sentence features of shape `(B, C)`, i.e.
+                ``encoder_out[:B]``
+            mlm_features (Tensor): features of the masked positions of shape
+                `(N, C)`, i.e. ``encoder_out[B:]``
+
+        Returns:
+            tuple:
+                - the masked LM logits of shape `(N, V)`
+                - the next sentence prediction logits of shape `(B,)`
+        """
+        model = self._model[0]
+        return model._mlm_head(mlm_features), model._nsp_head(nsp_features)
+
+
 class FairseqClassifierModel(BaseFairseqModel):
     def __init__(self, encoder, feature_dim, n_classes):
         super().__init__()
@@ -245,6 +375,10 @@ class FairseqLanguageModel(BaseFairseqModel):
         """
         return self.decoder(src_tokens)
 
+    def get_normalized_probs(self, net_output, log_probs, sample=None):
+        """Get normalized probabilities (or log probs) from a net's output."""
+        return self.decoder.get_normalized_probs(net_output, log_probs, sample)
+
     def max_positions(self):
         """Maximum length supported by the model."""
         return self.decoder.max_positions()
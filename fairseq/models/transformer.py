@@ -6,6 +6,7 @@
 # can be found in the PATENTS file in the same directory.
 
 import math
+from typing import Optional
 
 import torch
 import torch.nn as nn
@@ -25,16 +26,25 @@ from . import (
 )
 
 
-def gelu(x):
-    return x * 0.5 * (1.0 + torch.erf(x / math.sqrt(2.0)))
+if hasattr(F, 'gelu'):
+    # the exact (erf) GeLU as a single fused kernel
+    gelu = F.gelu
+else:
+    def gelu(x):
+        return x * 0.5 * (1.0 + torch.erf(x / math.sqrt(2.0)))
 
 
-class GeLU(nn.Module):
-    def __init__(self):
-        super(GeLU, self).__init__()
+if hasattr(nn, 'GELU'):
+    # use the built-in module, so that tracers and compilers see the
+    # activation directly instead of a Python wrapper around it
+    GeLU = nn.GELU
+else:
+    class GeLU(nn.Module):
+        def __init__(self):
+            super(GeLU, self).__init__()
 
-    def forward(self, input):
-        return gelu(input)
+        def forward(self, input):
+            return gelu(input)
 
 
 def _get_activation(s, module=False):
@@ -52,6 +62,89 @@ def _get_activation(s, module=False):
         raise NotImplementedError(f"Unrecognized activation {s}")
 
 
+@torch.jit.script
+def _linear_gelu_layer_norm(x, weight, bias, ln_weight, ln_bias, eps: float):
+    x = F.linear(x, weight, bias)
+    x = x * 0.5 * (1.0 + torch.erf(x / math.sqrt(2.0)))
+    return F.layer_norm(x, [x.size(-1)], ln_weight, ln_bias, eps)
+
+
+@torch.jit.script
+def _linear_relu_layer_norm(x, weight, bias, ln_weight, ln_bias, eps: float):
+    x = F.relu(F.linear(x, weight, bias))
+    return F.layer_norm(x, [x.size(-1)], ln_weight, ln_bias, eps)
+
+
+@torch.jit.script
+def _dropout_add_layer_norm(x, residual, ln_weight: Optional[torch.Tensor], ln_bias: Optional[torch.Tensor],
+                            eps: float, p: float, training: bool):
+    x = residual + F.dropout(x, p, training)
+    return F.layer_norm(x, [x.size(-1)], ln_weight, ln_bias, eps)
+
+
+@torch.jit.script
+def _bias_gelu_dropout(x, bias, p: float, training: bool):
+    x = x + bias
+    x = x * 0.5 * (1.0 + torch.erf(x / math.sqrt(2.0)))
+    return F.dropout(x, p, training)
+
+
+@torch.jit.script
+def _bias_relu_dropout(x, bias, p: float, training: bool):
+    return F.dropout(F.relu(x + bias), p, training)
+
+
+# scripted functions cannot be pickled, so modules keep the key into these
+# tables rather than the function itself, which keeps them deep-copyable
+_bias_act_dropout = {
+    'gelu': _bias_gelu_dropout,
+    'relu': _bias_relu_dropout,
+}
+
+_linear_act_layer_norm = {
+    'gelu': _linear_gelu_layer_norm,
+    'relu': _linear_relu_layer_norm,
+}
+
+
+class MidLayer(nn.Sequential):
+    """The ``Linear -> activation -> LayerNorm`` transform in front of the
+    masked LM projection.
+
+    It keeps the parameter names of the :class:`nn.Sequential` it replaces.
+    With either supported activation, the whole chain runs as a single
+    scripted function, so the JIT can fuse the elementwise ops around the
+    linear.
+    """
+
+    def __init__(self, embed_dim, act_fn):
+        super().__init__(
+            nn.Linear(embed_dim, embed_dim),
+            _get_activation(act_fn, module=True)(),
+            LayerNorm(embed_dim, elementwise_affine=True)
+        )
+        if isinstance(self[1], GeLU):
+            self._fused_act = 'gelu'
+        elif isinstance(self[1], nn.ReLU):
+            self._fused_act = 'relu'
+        else:
+            self._fused_act = None
+        self.fused = self._fused_act is not None and isinstance(self[2], nn.LayerNorm)
+
+    def prepare_for_onnx_export_(self):
+        # export the plain modules rather than the scripted function
+        self.fused = False
+
+    def forward(self, x):
+        # the dense layer may have been swapped for a quantized one
+        if not self.fused or type(self[0]) is not nn.Linear:
+            return super().forward(x)
+        dense, _, layer_norm = self
+        return _linear_act_layer_norm[self._fused_act](
+            x, dense.weight, dense.bias, layer_norm.weight, layer_norm.bias, layer_norm.eps,
+        )
+
+
 @register_model('transformer')
 class TransformerModel(FairseqModel):
     """
@@ -178,8 +271,10 @@ class TransformerModel(FairseqModel):
 
 @register_model('transformer_bert')
 class TransformerBertModel(FairseqBertModel):
-    def __init__(self, encoder, mid_layer, embed_out, feature_dim, enforce_idempotence):
-        super().__init__(encoder, mid_layer, embed_out, feature_dim, enforce_idempotence)
+    def __init__(self, encoder, mid_layer, embed_out, feature_dim, enforce_idempotence,
+                 padding_idx=1, mlm_prob=0.15):
+        super().__init__(encoder, mid_layer, embed_out, feature_dim, enforce_idempotence,
+                         padding_idx, mlm_prob)
 
     @staticmethod
     def add_args(parser):
@@ -211,6 +306,17 @@ class TransformerBertModel(FairseqBertModel):
                             help='name of the activation function')
         parser.add_argument('--enforce-idempotence', action='store_true',
                             help='enforce idempotence when training')
+        parser.add_argument('--unpad-ffn', action='store_true',
+                            help='skip padding positions in the encoder feed-forward blocks')
+        parser.add_argument('--tied-encoder-layers', type=int, metavar='K',
+                            help='share the weights of every K-th encoder layer, so that '
+                                 'encoder-layers / K distinct layers are stacked K times')
+        parser.add_argument('--compile-encoder-layers', type=str, metavar='MODE',
+                            choices=['default', 'reduce-overhead', 'max-autotune'],
+                            help='run the encoder layer stack through torch.compile with this mode')
+        parser.add_argument('--max-attn-chunk-mb', type=float, metavar='MB',
+                            help='compute the encoder self-attention for blocks of queries, so that '
+                                 'its logits take at most about MB megabytes at once')
 
     @classmethod
     def build_model(cls, args, task):
@@ -242,19 +348,15 @@ class TransformerBertModel(FairseqBertModel):
 
         encoder = TransformerEncoder(args, dictionary, embed_tokens, left_pad=False)
 
-        mid_layer = nn.Sequential(
-            nn.Linear(args.encoder_embed_dim, args.encoder_embed_dim),
-            _get_activation(args.act_fn, module=True)(),
-            LayerNorm(args.encoder_embed_dim, elementwise_affine=True)
-        )
+        mid_layer = MidLayer(args.encoder_embed_dim, args.act_fn)
 
         if not args.share_all_embeddings:
             embed_out = nn.Parameter(torch.Tensor(len(dictionary), args.encoder_embed_dim))
             nn.init.normal_(embed_out, mean=0, std=args.encoder_embed_dim ** -0.5)
-            return TransformerBertModel(encoder, mid_layer, embed_out, args.encoder_embed_dim, args.enforce_idempotence)
         else:
-            return TransformerBertModel(encoder, mid_layer, embed_tokens.weight,
-                                        args.encoder_embed_dim, args.enforce_idempotence)
+            embed_out = embed_tokens.weight
+        return TransformerBertModel(encoder, mid_layer, embed_out, args.encoder_embed_dim, args.enforce_idempotence,
+                                    dictionary.pad(), getattr(args, 'masked_lm_prob', 0.15))
 
 
 @register_model('transformer_classifier')
@@ -289,6 +391,17 @@ class TransformerClassifierModel(FairseqClassifierModel):
                             help='number of classifier classes')
         parser.add_argument('--act-fn', type=str, metavar='STR',
                             help='name of the activation function')
+        parser.add_argument('--unpad-ffn', action='store_true',
+                            help='skip padding positions in the encoder feed-forward blocks')
+        parser.add_argument('--tied-encoder-layers', type=int, metavar='K',
+                            help='share the weights of every K-th encoder layer, so that '
+                                 'encoder-layers / K distinct layers are stacked K times')
+        parser.add_argument('--compile-encoder-layers', type=str, metavar='MODE',
+                            choices=['default', 'reduce-overhead', 'max-autotune'],
+                            help='run the encoder layer stack through torch.compile with this mode')
+        parser.add_argument('--max-attn-chunk-mb', type=float, metavar='MB',
+                            help='compute the encoder self-attention for blocks of queries, so that '
+                                 'its logits take at most about MB megabytes at once')
 
     @classmethod
     def build_model(cls, args, task):
@@ -427,17 +540,29 @@ class TransformerEncoder(FairseqEncoder):
         ) if not args.no_token_positional_embeddings else None
         self.embed_segment = Embedding(2, embed_dim, self.padding_idx)
 
-        self.layers = nn.ModuleList([])
-        self.layers.extend([
+        tied_layers = getattr(args, 'tied_encoder_layers', 1)
+        if args.encoder_layers % tied_layers != 0:
+            raise ValueError('--encoder-layers must be divisible by --tied-encoder-layers')
+        distinct_layers = [
             TransformerEncoderLayer(args)
-            for i in range(args.encoder_layers)
-        ])
+            for i in range(args.encoder_layers // tied_layers)
+        ]
+        self.layers = nn.ModuleList([])
+        self.layers.extend(distinct_layers * tied_layers)
         self.register_buffer('version', torch.Tensor([2]))
         self.normalize = args.encoder_normalize_before
         if self.normalize:
            self.layer_norm = LayerNorm(embed_dim, not args.no_normalize_affine)
+        self.unpad_ffn = getattr(args, 'unpad_ffn', False)
+
+        self._run_layers = self._layer_stack
+        compile_mode = getattr(args, 'compile_encoder_layers', None)
+        if compile_mode is not None:
+            if not hasattr(torch, 'compile'):
+                raise NotImplementedError('--compile-encoder-layers requires a newer version of PyTorch')
+            self._run_layers = torch.compile(self._layer_stack, mode=compile_mode)
 
-    def forward(self, src_tokens, src_lengths, segment, last_layer_mask=None):
+    def forward(self, src_tokens, src_lengths, segment, last_layer_mask=None, return_embedding_out=False):
         """
         Args:
             src_tokens (LongTensor): tokens in the source language of shape
@@ -445,41 +570,35 @@ class TransformerEncoder(FairseqEncoder):
             src_lengths (torch.LongTensor): lengths of each source sentence of
                 shape `(batch)`
             segment (LongTensor): segment of the sentence (1 for the first and 0 for the second)
+            return_embedding_out (bool, optional): also return the (normalized)
+                input embeddings. Default: ``False``
         Returns:
             dict:
                 - **encoder_out** (Tensor): the last encoder layer's output of
                   shape `(src_len, batch, embed_dim)`
                 - **encoder_padding_mask** (ByteTensor): the positions of
                   padding elements of shape `(batch, src_len)`
+                - **embedding_out** (Tensor): the input embeddings of shape
+                  `(src_len, batch, embed_dim)` if *return_embedding_out* is
+                  set, ``None`` otherwise
         """
-        # embed tokens and positions
-        x = self.embed_scale * self.embed_tokens(src_tokens)
-        if self.embed_positions is not None:
-            x += self.embed_positions(src_tokens)
-        x += self.embed_segment(segment)
-        x = F.dropout(x, p=self.dropout, training=self.training)
+        x = self._embed(src_tokens, segment)
 
-        # B x T x C -> T x B x C
-        x = x.transpose(0, 1)
+        embedding_out = None
+        if return_embedding_out:
+            embedding_out = self.layer_norm(x) if self.normalize else x
 
-        if self.normalize:
-            embedding_out = self.layer_norm(x)
-        else:
-            embedding_out = x
-
-        # compute padding mask
+        # compute padding mask; it is passed on even if nothing is padded,
+        # since finding that out would wait for the device every forward
         encoder_padding_mask = src_tokens.eq(self.padding_idx)
-        if not encoder_padding_mask.any():
-            encoder_padding_mask = None
+
+        # positions of the non-padding tokens in the flattened T x B layout
+        nonpad_idx = None
+        if self.unpad_ffn:
+            nonpad_idx = encoder_padding_mask.t().reshape(-1).eq(0).nonzero().view(-1)
 
         # encoder layers
-        if last_layer_mask is None:
-            for layer in self.layers:
-                x = layer(x, encoder_padding_mask)
-        else:
-            for layer in self.layers[:-1]:
-                x = layer(x, encoder_padding_mask)
-            x = self.layers[-1](x, encoder_padding_mask, last_layer_mask)
+        x = self._run_layers(x, encoder_padding_mask, nonpad_idx, last_layer_mask)
 
         if self.normalize:
             x = self.layer_norm(x)
@@ -490,6 +609,50 @@ class TransformerEncoder(FairseqEncoder):
             'embedding_out': embedding_out  # T x B x C
         }
 
+    def _layer_stack(self, x, encoder_padding_mask, nonpad_idx, last_layer_mask):
+        """Run *x* through all encoder layers."""
+        if last_layer_mask is None:
+            for layer in self.layers:
+                x = layer(x, encoder_padding_mask, nonpad_idx=nonpad_idx)
+        else:
+            for layer in self.layers[:-1]:
+                x = layer(x, encoder_padding_mask, nonpad_idx=nonpad_idx)
+            x = self.layers[-1](x, encoder_padding_mask, last_layer_mask)
+        return x
+
+    def _embed(self, src_tokens, segment):
+        """Sum the token, position and segment embeddings of shape
+        `(src_len, batch, embed_dim)`."""
+        # look the embeddings up with transposed (T x B) indices, so that the
+        # sum comes out contiguous in T x B x C and never has to be restrided
+        src_tokens_t = src_tokens.t()
+        if self.embed_positions is not None:
+            x = self._embed_positions_and_segment(src_tokens, segment)
+        else:
+            x = self.embed_segment(segment.t())
+        # apply the token embedding scale as part of the addition instead
+        # of a separate pass over the scaled copy
+        x.add_(self.embed_tokens(src_tokens_t), alpha=self.embed_scale)
+        return F.dropout(x, p=self.dropout, training=self.training)
+
+    def _embed_positions_and_segment(self, src_tokens, segment):
+        """Sum of the position and segment embeddings of shape
+        `(src_len, batch, embed_dim)`.
+
+        Both are read with a single gather from a small table holding the sum
+        for every (segment, position) pair, instead of two gathers over the
+        whole batch and an addition.
+        """
+        # positions are derived from the B x T padding layout
+        positions = utils.make_positions(src_tokens, self.padding_idx, self.embed_positions.left_pad)
+        num_positions = self.padding_idx + 1 + src_tokens.size(1)
+        table = (
+            self.embed_segment(torch.arange(2, device=segment.device)).unsqueeze(1)
+            + self.embed_positions.embedding_table(num_positions).unsqueeze(0)
+        )
+        index = segment.t() * num_positions + positions.t()
+        return F.embedding(index, table.view(-1, table.size(-1)))
+
     def reorder_encoder_out(self, encoder_out, new_order):
         """
         Reorder encoder output according to *new_order*.
@@ -529,6 +692,10 @@ class TransformerEncoder(FairseqEncoder):
         return state_dict
 
 
+# future masks of TransformerDecoder, keyed by (device, dtype)
+_future_masks = {}
+
+
 class TransformerDecoder(FairseqIncrementalDecoder):
     """
     Transformer decoder consisting of *args.decoder_layers* layers. Each layer
@@ -588,12 +755,13 @@ class TransformerDecoder(FairseqIncrementalDecoder):
         elif not self.share_input_output_embed:
             self.embed_out = nn.Parameter(torch.Tensor(len(dictionary), output_embed_dim))
             nn.init.normal_(self.embed_out, mean=0, std=output_embed_dim ** -0.5)
+        self.output_projection = None
         self.register_buffer('version', torch.Tensor([2]))
         self.normalize = args.decoder_normalize_before and final_norm
         if self.normalize:
            self.layer_norm = LayerNorm(embed_dim, not args.no_normalize_affine)
 
-    def forward(self, prev_output_tokens, encoder_out=None, incremental_state=None):
+    def forward(self, prev_output_tokens, encoder_out=None, incremental_state=None, return_all_hiddens=False):
         """
         Args:
             prev_output_tokens (LongTensor): previous decoder outputs of shape
@@ -602,13 +770,17 @@ class TransformerDecoder(FairseqIncrementalDecoder):
                 encoder-side attention
             incremental_state (dict): dictionary used for storing state during
                 :ref:`Incremental decoding`
+            return_all_hiddens (bool, optional): also return the output of
+                every layer. Default: ``False``
 
         Returns:
             tuple:
                 - the last decoder layer's output of shape `(batch, tgt_len,
                   vocab)`
-                - the last decoder layer's attention weights of shape `(batch,
-                  tgt_len, src_len)`
+                - a dictionary with the last decoder layer's attention weights
+                  of shape `(batch, tgt_len, src_len)` under ``'attn'`` and
+                  the list of layer outputs under ``'inner_states'`` (``None``
+                  unless *return_all_hiddens* is set)
         """
         # embed positions
         positions = self.embed_positions(
@@ -622,20 +794,29 @@ class TransformerDecoder(FairseqIncrementalDecoder):
                 positions = positions[:, -1:]
 
         # embed tokens and positions
-        x = self.embed_scale * self.embed_tokens(prev_output_tokens)
+        x = self.embed_tokens(prev_output_tokens)
 
         if self.project_in_dim is not None:
+            # the projection has no bias, so it commutes with the scaling
             x = self.project_in_dim(x)
 
+        # apply the token embedding scale as part of the addition instead
+        # of a separate pass over the scaled copy
         if positions is not None:
-            x += positions
+            x = torch.add(positions, x, alpha=self.embed_scale)
+        else:
+            x = self.embed_scale * x
         x = F.dropout(x, p=self.dropout, training=self.training)
 
         # B x T x C -> T x B x C
         x = x.transpose(0, 1)
         attn = None
 
-        inner_states = [x]
+        # keeping every layer's output alive is only worth it if requested
+        inner_states = [x] if return_all_hiddens else None
+
+        # the causal mask is the same for every layer
+        self_attn_mask = self.buffered_future_mask(x) if incremental_state is None else None
 
         # decoder layers
         for layer in self.layers:
@@ -644,9 +825,11 @@ class TransformerDecoder(FairseqIncrementalDecoder):
                 encoder_out['encoder_out'] if encoder_out is not None else None,
                 encoder_out['encoder_padding_mask'] if encoder_out is not None else None,
                 incremental_state,
-                self_attn_mask=self.buffered_future_mask(x) if incremental_state is None else None,
+                self_attn_mask=self_attn_mask,
+                self_attn_is_causal=self_attn_mask is not None,
             )
-            inner_states.append(x)
+            if inner_states is not None:
+                inner_states.append(x)
 
         if self.normalize:
             x = self.layer_norm(x)
@@ -659,7 +842,9 @@ class TransformerDecoder(FairseqIncrementalDecoder):
 
         if self.adaptive_softmax is None:
             # project back to size of vocabulary
-            if self.share_input_output_embed:
+            if self.output_projection is not None:
+                x = self.output_projection(x)
+            elif self.share_input_output_embed:
                 x = F.linear(x, self.embed_tokens.weight)
             else:
                 x = F.linear(x, self.embed_out)
@@ -672,13 +857,28 @@ class TransformerDecoder(FairseqIncrementalDecoder):
             return self.max_target_positions
         return min(self.max_target_positions, self.embed_positions.max_positions())
 
+    def prepare_for_quantization_(self):
+        """Wrap the vocabulary projection in an :class:`nn.Linear`, so that it
+        gets quantized along with the other linear layers."""
+        if self.adaptive_softmax is not None:
+            return
+        weight = self.embed_tokens.weight if self.share_input_output_embed else self.embed_out
+        self.output_projection = _build_uninitialized(nn.Linear, weight.size(1), weight.size(0), bias=False)
+        self.output_projection.weight = weight
+
     def buffered_future_mask(self, tensor):
         dim = tensor.size(0)
-        if not hasattr(self, '_future_mask') or self._future_mask is None or self._future_mask.device != tensor.device:
-            self._future_mask = torch.triu(utils.fill_with_neg_inf(tensor.new(dim, dim)), 1)
-        if self._future_mask.size(0) < dim:
-            self._future_mask = torch.triu(utils.fill_with_neg_inf(self._future_mask.resize_(dim, dim)), 1)
-        return self._future_mask[:dim, :dim]
+        # keep one mask per device and type, shared by all decoders (e.g. of
+        # an ensemble), and grow it geometrically, so that neither switching
+        # devices nor slowly growing lengths rebuild the O(T^2) mask on
+        # every call
+        key = (tensor.device, tensor.dtype)
+        future_mask = _future_masks.get(key)
+        if future_mask is None or future_mask.size(0) < dim:
+            size = dim if future_mask is None else max(dim, 2 * future_mask.size(0))
+            future_mask = torch.triu(utils.fill_with_neg_inf(tensor.new(size, size)), 1)
+            _future_masks[key] = future_mask
+        return future_mask[:dim, :dim]
 
     def upgrade_state_dict(self, state_dict):
         """Upgrade a (possibly old) state dict for new versions of fairseq."""
@@ -687,19 +887,18 @@ class TransformerDecoder(FairseqIncrementalDecoder):
                 del state_dict['decoder.embed_positions.weights']
             state_dict['decoder.embed_positions._float_tensor'] = torch.FloatTensor(1)
 
+        # update layer norms
+        layer_norm_map = {
+            '0': 'self_attn_layer_norm',
+            '1': 'encoder_attn_layer_norm',
+            '2': 'final_layer_norm'
+        }
         for i in range(len(self.layers)):
-            # update layer norms
-            layer_norm_map = {
-                '0': 'self_attn_layer_norm',
-                '1': 'encoder_attn_layer_norm',
-                '2': 'final_layer_norm'
-            }
             for old, new in layer_norm_map.items():
                 for m in ('weight', 'bias'):
-                    k = 'decoder.layers.{}.layer_norms.{}.{}'.format(i, old, m)
-                    if k in state_dict:
-                        state_dict['decoder.layers.{}.{}.{}'.format(i, new, m)] = state_dict[k]
-                        del state_dict[k]
+                    v = state_dict.pop('decoder.layers.{}.layer_norms.{}.{}'.format(i, old, m), None)
+                    if v is not None:
+                        state_dict['decoder.layers.{}.{}.{}'.format(i, new, m)] = v
         if utils.item(state_dict.get('decoder.version', torch.Tensor([1]))[0]) < 2:
             # earlier checkpoints did not normalize after the stack of layers
             self.layer_norm = None
@@ -731,6 +930,7 @@ class TransformerEncoderLayer(nn.Module):
         self.self_attn = MultiheadAttention(
             self.embed_dim, args.encoder_attention_heads,
             dropout=args.attention_dropout,
+            max_chunk_mb=getattr(args, 'max_attn_chunk_mb', None),
         )
         self.dropout = args.dropout
         self.relu_dropout = args.relu_dropout
@@ -738,44 +938,81 @@ class TransformerEncoderLayer(nn.Module):
         self.fc1 = Linear(self.embed_dim, args.encoder_ffn_embed_dim)
         self.fc2 = Linear(args.encoder_ffn_embed_dim, self.embed_dim, nonlinearity='relu')
         self.layer_norms = nn.ModuleList([LayerNorm(self.embed_dim, not args.no_normalize_affine) for i in range(2)])
+        # plain references for forward, which skip the ModuleList lookup; a
+        # tuple is not registered as a submodule, so the state dict is unchanged
+        self._layer_norms = tuple(self.layer_norms)
         self.act_fn = _get_activation(args.act_fn)
+        self.act_fn_name = args.act_fn
 
-    def forward(self, x, encoder_padding_mask, last_layer_mask=None):
+    def forward(self, x, encoder_padding_mask, last_layer_mask=None, nonpad_idx=None):
         """
         Args:
             x (Tensor): input to the layer of shape `(seq_len, batch, embed_dim)`
             encoder_padding_mask (ByteTensor): binary ByteTensor of shape
                 `(batch, src_len)` where padding elements are indicated by ``1``.
+            nonpad_idx (LongTensor, optional): indices of the non-padding
+                positions in *x* viewed as `(seq_len * batch, embed_dim)`. If
+                given, the feed-forward block skips the padding positions,
+                which are passed through unchanged.
 
         Returns:
             encoded output of shape `(batch, src_len, embed_dim)`
         """
         residual = x
-        x = self.maybe_layer_norm(0, x, before=True)
-        x, _ = self.self_attn(query=x, key=x, value=x, key_padding_mask=encoder_padding_mask)
-        x = F.dropout(x, p=self.dropout, training=self.training)
-        x = residual + x
-        x = self.maybe_layer_norm(0, x, after=True)
+        x = self.pre_norm(self._layer_norms[0], x)
+        x, _ = self.self_attn(query=x, key=x, value=x, key_padding_mask=encoder_padding_mask, need_weights=False)
+        x = self.postprocess(self._layer_norms[0], x, residual)
 
         if last_layer_mask is not None:
-            x = torch.cat([x[0, ...], x.transpose(0, 1)[last_layer_mask]], dim=0)  # (B + N) x C
-
+            # gather the first position of every sentence followed by the
+            # masked positions in batch-major order, with a single
+            # index_select on the flattened T x B layout
+            seq_len, bsz = x.size(0), x.size(1)
+            masked = last_layer_mask.nonzero()
+            idx = torch.cat([
+                torch.arange(bsz, device=x.device),
+                masked[:, 1] * bsz + masked[:, 0],
+            ])
+            x = x.reshape(seq_len * bsz, -1).index_select(0, idx)  # (B + N) x C
+        elif nonpad_idx is not None:
+            x_flat = x.view(-1, x.size(-1))
+            x_flat = x_flat.index_copy(0, nonpad_idx, self._ffn(x_flat.index_select(0, nonpad_idx)))
+            return x_flat.view_as(x)
+
+        return self._ffn(x)
+
+    def _ffn(self, x):
         residual = x
-        x = self.maybe_layer_norm(1, x, before=True)
-        x = self.act_fn(self.fc1(x))
-        x = F.dropout(x, p=self.relu_dropout, training=self.training)
+        x = self.pre_norm(self._layer_norms[1], x)
+        x = self.fc1_act_dropout(x)
         x = self.fc2(x)
-        x = F.dropout(x, p=self.dropout, training=self.training)
-        x = residual + x
-        x = self.maybe_layer_norm(1, x, after=True)
-        return x
-
-    def maybe_layer_norm(self, i, x, before=False, after=False):
-        assert before ^ after
-        if after ^ self.normalize_before:
-            return self.layer_norms[i](x)
-        else:
-            return x
+        return self.postprocess(self._layer_norms[1], x, residual)
+
+    def fc1_act_dropout(self, x):
+        """``fc1 -> activation -> dropout``. The bias of *fc1* is added
+        together with the activation and dropout in one scripted function,
+        so the JIT can fuse them into a single pass over the FFN
+        activations."""
+        # fc1 may have been swapped for a quantized module
+        if type(self.fc1) is not nn.Linear:
+            x = self.act_fn(self.fc1(x))
+            return F.dropout(x, p=self.relu_dropout, training=self.training)
+        return _bias_act_dropout[self.act_fn_name](F.linear(x, self.fc1.weight), self.fc1.bias, self.relu_dropout, self.training)
+
+    def pre_norm(self, layer_norm, x):
+        """Apply *layer_norm* before the sublayer if the layer is set up that
+        way; :func:`postprocess` handles the other case."""
+        return layer_norm(x) if self.normalize_before else x
+
+    def postprocess(self, layer_norm, x, residual):
+        """``dropout -> add residual``, followed by *layer_norm* unless it is
+        applied before the sublayer. The post-norm variant runs as a single
+        scripted function, so the JIT can fuse the three steps."""
+        if self.normalize_before:
+            return residual + F.dropout(x, p=self.dropout, training=self.training)
+        return _dropout_add_layer_norm(
+            x, residual, layer_norm.weight, layer_norm.bias, layer_norm.eps, self.dropout, self.training,
+        )
 
 
 class TransformerDecoderLayer(nn.Module):
@@ -827,24 +1064,27 @@ class TransformerDecoderLayer(nn.Module):
         self.onnx_trace = False
 
         self.act_fn = _get_activation(args.act_fn)
+        self.act_fn_name = args.act_fn
 
     def prepare_for_onnx_export_(self):
         self.onnx_trace = True
 
     def forward(self, x, encoder_out, encoder_padding_mask, incremental_state,
                 prev_self_attn_state=None, prev_attn_state=None, self_attn_mask=None,
-                self_attn_padding_mask=None):
+                self_attn_padding_mask=None, self_attn_is_causal=False):
         """
         Args:
             x (Tensor): input to the layer of shape `(seq_len, batch, embed_dim)`
             encoder_padding_mask (ByteTensor): binary ByteTensor of shape
                 `(batch, src_len)` where padding elements are indicated by ``1``.
+            self_attn_is_causal (bool, optional): whether *self_attn_mask* is
+                the usual future mask. Default: ``False``
 
         Returns:
             encoded output of shape `(batch, src_len, embed_dim)`
         """
         residual = x
-        x = self.maybe_layer_norm(self.self_attn_layer_norm, x, before=True)
+        x = self.pre_norm(self.self_attn_layer_norm, x)
         if prev_self_attn_state is not None:
             if incremental_state is None:
                 incremental_state = {}
@@ -859,15 +1099,14 @@ class TransformerDecoderLayer(nn.Module):
             incremental_state=incremental_state,
             need_weights=False,
             attn_mask=self_attn_mask,
+            is_causal=self_attn_is_causal,
         )
-        x = F.dropout(x, p=self.dropout, training=self.training)
-        x = residual + x
-        x = self.maybe_layer_norm(self.self_attn_layer_norm, x, after=True)
+        x = self.postprocess(self.self_attn_layer_norm, x, residual)
 
         attn = None
         if self.encoder_attn is not None:
             residual = x
-            x = self.maybe_layer_norm(self.encoder_attn_layer_norm, x, before=True)
+            x = self.pre_norm(self.encoder_attn_layer_norm, x)
             if prev_attn_state is not None:
                 if incremental_state is None:
                     incremental_state = {}
@@ -883,37 +1122,62 @@ class TransformerDecoderLayer(nn.Module):
                 static_kv=True,
                 need_weights=(not self.training and self.need_attn),
             )
-            x = F.dropout(x, p=self.dropout, training=self.training)
-            x = residual + x
-            x = self.maybe_layer_norm(self.encoder_attn_layer_norm, x, after=True)
+            x = self.postprocess(self.encoder_attn_layer_norm, x, residual)
 
         residual = x
-        x = self.maybe_layer_norm(self.final_layer_norm, x, before=True)
-        x = self.act_fn(self.fc1(x))
-        x = F.dropout(x, p=self.relu_dropout, training=self.training)
+        x = self.pre_norm(self.final_layer_norm, x)
+        x = self.fc1_act_dropout(x)
         x = self.fc2(x)
-        x = F.dropout(x, p=self.dropout, training=self.training)
-        x = residual + x
-        x = self.maybe_layer_norm(self.final_layer_norm, x, after=True)
+        x = self.postprocess(self.final_layer_norm, x, residual)
         if self.onnx_trace:
             saved_state = self.self_attn._get_input_buffer(incremental_state)
             self_attn_state = saved_state["prev_key"], saved_state["prev_value"]
             return x, attn, self_attn_state
         return x, attn
 
-    def maybe_layer_norm(self, layer_norm, x, before=False, after=False):
-        assert before ^ after
-        if after ^ self.normalize_before:
-            return layer_norm(x)
-        else:
-            return x
+    def fc1_act_dropout(self, x):
+        """``fc1 -> activation -> dropout``. The bias of *fc1* is added
+        together with the activation and dropout in one scripted function,
+        so the JIT can fuse them into a single pass over the FFN
+        activations."""
+        # fc1 may have been swapped for a quantized module
+        if self.onnx_trace or type(self.fc1) is not nn.Linear:
+            x = self.act_fn(self.fc1(x))
+            return F.dropout(x, p=self.relu_dropout, training=self.training)
+        return _bias_act_dropout[self.act_fn_name](F.linear(x, self.fc1.weight), self.fc1.bias, self.relu_dropout, self.training)
+
+    def pre_norm(self, layer_norm, x):
+        """Apply *layer_norm* before the sublayer if the layer is set up that
+        way; :func:`postprocess` handles the other case."""
+        return layer_norm(x) if self.normalize_before else x
+
+    def postprocess(self, layer_norm, x, residual):
+        """``dropout -> add residual``, followed by *layer_norm* unless it is
+        applied before the sublayer. The post-norm variant runs as a single
+        scripted function, so the JIT can fuse the three steps."""
+        if self.normalize_before:
+            return residual + F.dropout(x, p=self.dropout, training=self.training)
+        if self.onnx_trace:
+            # export the plain modules rather than the scripted function
+            return layer_norm(residual + F.dropout(x, p=self.dropout, training=self.training))
+        return _dropout_add_layer_norm(
+            x, residual, layer_norm.weight, layer_norm.bias, layer_norm.eps, self.dropout, self.training,
+        )
 
     def make_generation_fast_(self, need_attn=False, **kwargs):
         self.need_attn = need_attn
 
 
+def _build_uninitialized(module_cls, *args, **kwargs):
+    """Build *module_cls* without running its default initialization, for
+    callers that initialize all of its parameters themselves."""
+    if hasattr(nn.utils, 'skip_init'):
+        return nn.utils.skip_init(module_cls, *args, **kwargs)
+    return module_cls(*args, **kwargs)
+
+
 def Embedding(num_embeddings, embedding_dim, padding_idx):
-    m = nn.Embedding(num_embeddings, embedding_dim, padding_idx=padding_idx)
+    m = _build_uninitialized(nn.Embedding, num_embeddings, embedding_dim, padding_idx=padding_idx)
     nn.init.normal_(m.weight, mean=0, std=embedding_dim ** -0.5)
     nn.init.constant_(m.weight[padding_idx], 0)
     return m
@@ -925,7 +1189,7 @@ def LayerNorm(embedding_dim, elementwise_affine=True):
 
 
 def Linear(in_features, out_features, bias=True, uniform=False, nonlinearity='linear'):
-    m = nn.Linear(in_features, out_features, bias)
+    m = _build_uninitialized(nn.Linear, in_features, out_features, bias)
     if uniform:
         nn.init.kaiming_uniform_(m.weight)
     else:
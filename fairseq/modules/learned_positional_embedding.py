@@ -5,6 +5,7 @@
 # the root directory of this source tree. An additional grant of patent rights
 # can be found in the PATENTS file in the same directory.
 
+import torch
 import torch.nn as nn
 
 from fairseq import utils
@@ -30,6 +31,11 @@ class LearnedPositionalEmbedding(nn.Embedding):
             positions = utils.make_positions(input.data, self.padding_idx, self.left_pad)
         return super().forward(positions)
 
+    def embedding_table(self, num_positions):
+        """Embeddings of the first *num_positions* position ids (padding
+        included), looked up so that the padding row gets no gradient."""
+        return super().forward(torch.arange(num_positions, device=self.weight.device))
+
     def max_positions(self):
         """Maximum number of supported positions."""
         return self.num_embeddings - self.padding_idx - 1
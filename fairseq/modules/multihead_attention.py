@@ -13,13 +13,22 @@ import torch.nn.functional as F
 from fairseq import utils
 
 
+# fused attention kernels are only available in recent versions of PyTorch
+_has_sdpa = hasattr(F, 'scaled_dot_product_attention')
+
+
 class MultiheadAttention(nn.Module):
     """Multi-headed attention.
 
     See "Attention Is All You Need" for more details.
+
+    If *max_chunk_mb* is set and the attention weights are not returned, the
+    attention logits are computed for blocks of queries at a time, so that
+    no more than about *max_chunk_mb* megabytes of them exist at once.
     """
 
-    def __init__(self, embed_dim, num_heads, dropout=0., bias=True, add_bias_kv=False, add_zero_attn=False):
+    def __init__(self, embed_dim, num_heads, dropout=0., bias=True, add_bias_kv=False, add_zero_attn=False,
+                 max_chunk_mb=None):
         super().__init__()
         self.embed_dim = embed_dim
         self.num_heads = num_heads
@@ -42,6 +51,7 @@ class MultiheadAttention(nn.Module):
             self.bias_k = self.bias_v = None
 
         self.add_zero_attn = add_zero_attn
+        self.max_chunk_mb = max_chunk_mb
 
         self.reset_parameters()
 
@@ -62,7 +72,7 @@ class MultiheadAttention(nn.Module):
             nn.init.xavier_normal_(self.bias_v)
 
     def forward(self, query, key, value, key_padding_mask=None, incremental_state=None,
-                need_weights=True, static_kv=False, attn_mask=None):
+                need_weights=True, static_kv=False, attn_mask=None, is_causal=False):
         """Input shape: Time x Batch x Channel
 
         Self-attention can be implemented by passing in the same arguments for
@@ -70,6 +80,8 @@ class MultiheadAttention(nn.Module):
         `attn_mask` argument. Padding elements can be excluded from
         the key by passing a binary ByteTensor (`key_padding_mask`) with shape:
         batch x src_len, where padding elements are indicated by 1s.
+        Setting `is_causal` declares that `attn_mask` is the usual future
+        mask, which the fused kernel can then apply without reading it.
         """
 
         qkv_same = query.data_ptr() == key.data_ptr() == value.data_ptr()
@@ -106,7 +118,12 @@ class MultiheadAttention(nn.Module):
             q = self.in_proj_q(query)
             k = self.in_proj_k(key)
             v = self.in_proj_v(value)
-        q *= self.scaling
+
+        # the fused kernel never materializes the attention weights, so it
+        # can only be used when they are not returned
+        use_sdpa = _has_sdpa and not need_weights and not self.onnx_trace
+        if not use_sdpa:
+            q *= self.scaling
 
         if saved_state is not None:
 
@@ -154,6 +171,54 @@ class MultiheadAttention(nn.Module):
             if key_padding_mask is not None:
                 key_padding_mask = torch.cat([key_padding_mask, key_padding_mask.new_zeros(key_padding_mask.size(0), 1)], dim=1)
 
+        chunk_len = tgt_len
+        if not need_weights and self.max_chunk_mb is not None:
+            # number of queries whose FP32 logits fit into the budget
+            chunk_len = max(1, int(self.max_chunk_mb * 2 ** 20) // (bsz * self.num_heads * src_len * 4))
+
+        if use_sdpa:
+            if chunk_len < tgt_len:
+                attn = torch.cat([
+                    self._scaled_dot_product_attention(q_chunk, k, v, bsz, mask_chunk, key_padding_mask)
+                    for q_chunk, mask_chunk in self._query_chunks(q, attn_mask, chunk_len)
+                ], dim=1)
+            else:
+                attn = self._scaled_dot_product_attention(q, k, v, bsz, attn_mask, key_padding_mask, is_causal)
+            attn = attn.transpose(0, 1).contiguous().view(tgt_len, bsz, embed_dim)
+            return self.out_proj(attn), None
+
+        if chunk_len < tgt_len:
+            attn = torch.cat([
+                self._attend(q_chunk, k, v, bsz, mask_chunk, key_padding_mask)[0]
+                for q_chunk, mask_chunk in self._query_chunks(q, attn_mask, chunk_len)
+            ], dim=1)
+        else:
+            attn, attn_weights = self._attend(q, k, v, bsz, attn_mask, key_padding_mask)
+        assert list(attn.size()) == [bsz * self.num_heads, tgt_len, self.head_dim]
+        attn = attn.transpose(0, 1).contiguous().view(tgt_len, bsz, embed_dim)
+        attn = self.out_proj(attn)
+
+        if need_weights:
+            # average attention weights over heads
+            attn_weights = attn_weights.view(bsz, self.num_heads, tgt_len, src_len)
+            attn_weights = attn_weights.sum(dim=1) / self.num_heads
+        else:
+            attn_weights = None
+
+        return attn, attn_weights
+
+    @staticmethod
+    def _query_chunks(q, attn_mask, chunk_len):
+        """Split the queries and the matching rows of *attn_mask* into blocks
+        of *chunk_len* queries."""
+        for i in range(0, q.size(1), chunk_len):
+            yield q[:, i:i + chunk_len], attn_mask[i:i + chunk_len] if attn_mask is not None else None
+
+    def _attend(self, q, k, v, bsz, attn_mask, key_padding_mask):
+        """Attend with explicit attention weights. Returns the output of
+        shape `(bsz * num_heads, tgt_len, head_dim)` and the weights of shape
+        `(bsz * num_heads, tgt_len, src_len)`."""
+        tgt_len, src_len = q.size(1), k.size(1)
         attn_weights = torch.bmm(q, k.transpose(1, 2))
         assert list(attn_weights.size()) == [bsz * self.num_heads, tgt_len, src_len]
 
@@ -171,19 +236,39 @@ class MultiheadAttention(nn.Module):
         attn_weights = F.softmax(attn_weights.float(), dim=-1).type_as(attn_weights)
         attn_weights = F.dropout(attn_weights, p=self.dropout, training=self.training)
 
-        attn = torch.bmm(attn_weights, v)
-        assert list(attn.size()) == [bsz * self.num_heads, tgt_len, self.head_dim]
-        attn = attn.transpose(0, 1).contiguous().view(tgt_len, bsz, embed_dim)
-        attn = self.out_proj(attn)
-
-        if need_weights:
-            # average attention weights over heads
-            attn_weights = attn_weights.view(bsz, self.num_heads, tgt_len, src_len)
-            attn_weights = attn_weights.sum(dim=1) / self.num_heads
-        else:
-            attn_weights = None
+        return torch.bmm(attn_weights, v), attn_weights
+
+    def _scaled_dot_product_attention(self, q, k, v, bsz, attn_mask, key_padding_mask, is_causal=False):
+        """Attend with :func:`F.scaled_dot_product_attention`, which applies
+        the scaling itself. Inputs and output are of shape
+        `(bsz * num_heads, len, head_dim)`."""
+        q = q.view(bsz, self.num_heads, -1, self.head_dim)
+        k = k.view(bsz, self.num_heads, -1, self.head_dim)
+        v = v.view(bsz, self.num_heads, -1, self.head_dim)
+
+        if is_causal and key_padding_mask is None and q.size(2) == k.size(2):
+            # the kernel builds the future mask itself, which lets it pick
+            # the flash attention backend
+            attn = F.scaled_dot_product_attention(
+                q, k, v, dropout_p=self.dropout if self.training else 0., is_causal=True,
+            )
+            return attn.reshape(bsz * self.num_heads, -1, self.head_dim)
+
+        # fold both masks into one additive mask of shape
+        # bsz x 1 x (1 or tgt_len) x src_len
+        mask = None
+        if key_padding_mask is not None:
+            mask = q.new_zeros(bsz, 1, 1, k.size(2)).masked_fill(
+                key_padding_mask.view(bsz, 1, 1, -1).bool(), float('-inf'),
+            )
+        if attn_mask is not None:
+            attn_mask = attn_mask.type_as(q)
+            mask = attn_mask if mask is None else mask + attn_mask
 
-        return attn, attn_weights
+        attn = F.scaled_dot_product_attention(
+            q, k, v, attn_mask=mask, dropout_p=self.dropout if self.training else 0.,
+        )
+        return attn.reshape(bsz * self.num_heads, -1, self.head_dim)
 
     def in_proj_qkv(self, query):
         return self._in_proj(query).chunk(3, dim=-1)
@@ -26,11 +26,10 @@ class SinusoidalPositionalEmbedding(nn.Module):
         self.embedding_dim = embedding_dim
         self.padding_idx = padding_idx
         self.left_pad = left_pad
-        self.weights = SinusoidalPositionalEmbedding.get_embedding(
-            init_size,
-            embedding_dim,
-            padding_idx,
-        )
+        # the table is built on first use, directly with the type of the
+        # module, and then kept for every later call
+        self.init_size = init_size
+        self.weights = None
         self.onnx_trace = False
         self.register_buffer('_float_tensor', torch.FloatTensor(1))
 
@@ -60,14 +59,7 @@ class SinusoidalPositionalEmbedding(nn.Module):
         """Input is expected to be of size [bsz x seqlen]."""
         bsz, seq_len = torch.onnx.operators.shape_as_tensor(input)
         max_pos = self.padding_idx + 1 + seq_len
-        if self.weights is None or max_pos > self.weights.size(0):
-            # recompute/expand embeddings if needed
-            self.weights = SinusoidalPositionalEmbedding.get_embedding(
-                max_pos,
-                self.embedding_dim,
-                self.padding_idx,
-            )
-        self.weights = self.weights.type_as(self._float_tensor)
+        self._ensure_weights(max_pos)
 
         if incremental_state is not None:
             # positions is the same for every token when decoding a single step
@@ -84,6 +76,22 @@ class SinusoidalPositionalEmbedding(nn.Module):
             return embeddings
         return self.weights.index_select(0, positions.view(-1)).view(bsz, seq_len, -1).detach()
 
+    def embedding_table(self, num_positions):
+        """Embeddings of the first *num_positions* position ids (padding
+        included)."""
+        self._ensure_weights(num_positions)
+        return self.weights[:num_positions].detach()
+
+    def _ensure_weights(self, max_pos):
+        if self.weights is None or max_pos > self.weights.size(0):
+            # compute/expand embeddings if needed
+            self.weights = SinusoidalPositionalEmbedding.get_embedding(
+                max(max_pos, self.init_size),
+                self.embedding_dim,
+                self.padding_idx,
+            )
+        self.weights = self.weights.type_as(self._float_tensor)
+
     def max_positions(self):
         """Maximum number of supported positions."""
         return int(1e5)  # an arbitrary large number
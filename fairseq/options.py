@@ -137,6 +137,8 @@ def get_parser(desc, default_task='translation'):
     parser.add_argument('--fp16', action='store_true', help='use FP16')
     parser.add_argument('--fp16-init-scale', default=2**7, type=int,
                         help='default FP16 loss scale')
+    parser.add_argument('--bf16', action='store_true',
+                        help='run the forward pass under bfloat16 autocast (weights stay in FP32)')
 
     # Task definitions can be found under fairseq/tasks/
     parser.add_argument(
@@ -156,6 +158,8 @@ def add_dataset_args(parser, train=False, gen=False):
                        help='maximum number of tokens in a batch')
     group.add_argument('--max-sentences', '--batch-size', type=int, metavar='N',
                        help='maximum number of sentences in a batch')
+    group.add_argument('--num-workers', default=0, type=int, metavar='N',
+                       help='how many subprocesses to use for data loading')
     if train:
         group.add_argument('--train-subset', default='train', metavar='SPLIT',
                            choices=['train', 'valid', 'test'],
@@ -349,6 +353,8 @@ def add_inference_args(parser):
     add_common_eval_args(group)
     group.add_argument('--output', type=str, metavar='PATH',
                        help='path of inference output')
+    group.add_argument('--quantize', action='store_true',
+                       help='run linear layers with int8 weights (requires --cpu)')
     return group
 
 
@@ -13,7 +13,7 @@ from torch.utils.data import ConcatDataset
 
 from fairseq import options
 from fairseq.data import (
-    Dictionary, BertDictionary, IndexedInMemoryDataset,
+    Dictionary, BertDictionary, IndexedMMapDataset,
     IndexedRawTextDataset, BertDataset
 )
 from . import FairseqTask, register_task
@@ -88,15 +88,15 @@ class BertTask(FairseqTask):
             filename = os.path.join(data_path, split)
             if self.args.raw_text and IndexedRawTextDataset.exists(filename):
                 return True
-            elif not self.args.raw_text and IndexedInMemoryDataset.exists(filename):
+            elif not self.args.raw_text and IndexedMMapDataset.exists(filename):
                 return True
             return False
 
         def indexed_dataset(path, dictionary):
             if self.args.raw_text:
                 return IndexedRawTextDataset(path, dictionary)
-            elif IndexedInMemoryDataset.exists(path):
-                return IndexedInMemoryDataset(path, fix_lua_indexing=True)
+            elif IndexedMMapDataset.exists(path):
+                return IndexedMMapDataset(path, fix_lua_indexing=True)
             return None
 
         datasets = []
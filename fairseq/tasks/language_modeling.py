@@ -9,10 +9,11 @@ import itertools
 import numpy as np
 import os
 
+import torch
 from torch.utils.data import ConcatDataset
 
 from fairseq.data import (
-    Dictionary, IndexedInMemoryDataset, IndexedRawTextDataset,
+    Dictionary, IndexedMMapDataset, IndexedRawTextDataset,
     MonolingualDataset, TokenBlockDataset, TruncatedDictionary
 )
 
@@ -135,9 +136,9 @@ class LanguageModelingTask(FairseqTask):
 
             if self.args.raw_text and IndexedRawTextDataset.exists(path):
                 ds = IndexedRawTextDataset(path, self.dictionary)
-                tokens = [t for l in ds.tokens_list for t in l]
-            elif not self.args.raw_text and IndexedInMemoryDataset.exists(path):
-                ds = IndexedInMemoryDataset(path, fix_lua_indexing=True)
+                tokens = torch.cat(ds.tokens_list).numpy()
+            elif not self.args.raw_text and IndexedMMapDataset.exists(path):
+                ds = IndexedMMapDataset(path, fix_lua_indexing=True)
                 tokens = ds.buffer
             else:
                 if k > 0:
@@ -6,6 +6,7 @@
 # can be found in the PATENTS file in the same directory.
 
 import itertools
+from multiprocessing.pool import ThreadPool
 import numpy as np
 import os
 
@@ -13,7 +14,7 @@ from torch.utils.data import ConcatDataset
 
 from fairseq import options
 from fairseq.data import (
-    data_utils, BertDictionary, LanguagePairDataset, IndexedInMemoryDataset,
+    data_utils, BertDictionary, LanguagePairDataset, IndexedMMapDataset,
     IndexedRawTextDataset,
 )
 
@@ -87,6 +88,9 @@ class TranslationTask(FairseqTask):
         # load dictionaries
         src_dict = BertDictionary.load(os.path.join(args.data[0], 'dict.{}.txt'.format(args.source_lang)))
         tgt_dict = BertDictionary.load(os.path.join(args.data[0], 'dict.{}.txt'.format(args.target_lang)))
+        if tgt_dict == src_dict:
+            # with a joined vocabulary both sides share a single dictionary
+            tgt_dict = src_dict
         assert src_dict.pad() == tgt_dict.pad()
         assert src_dict.eos() == tgt_dict.eos()
         assert src_dict.unk() == tgt_dict.unk()
@@ -107,28 +111,26 @@ class TranslationTask(FairseqTask):
             filename = os.path.join(data_path, '{}.{}-{}.{}'.format(split, src, tgt, lang))
             if self.args.raw_text and IndexedRawTextDataset.exists(filename):
                 return True
-            elif not self.args.raw_text and IndexedInMemoryDataset.exists(filename):
+            elif not self.args.raw_text and IndexedMMapDataset.exists(filename):
                 return True
             return False
 
         def indexed_dataset(path, dictionary):
             if self.args.raw_text:
                 return IndexedRawTextDataset(path, dictionary)
-            elif IndexedInMemoryDataset.exists(path):
-                return IndexedInMemoryDataset(path, fix_lua_indexing=True)
+            elif IndexedMMapDataset.exists(path):
+                return IndexedMMapDataset(path, fix_lua_indexing=True)
             return None
 
-        src_datasets = []
-        tgt_datasets = []
-
         data_paths = self.args.data
+        src, tgt = self.args.source_lang, self.args.target_lang
 
+        shards = []
         for data_path in data_paths:
             for k in itertools.count():
                 split_k = split + (str(k) if k > 0 else '')
 
                 # infer langcode
-                src, tgt = self.args.source_lang, self.args.target_lang
                 if split_exists(split_k, src, tgt, src, data_path):
                     prefix = os.path.join(data_path, '{}.{}-{}.'.format(split_k, src, tgt))
                 elif split_exists(split_k, tgt, src, src, data_path):
@@ -139,16 +141,27 @@ class TranslationTask(FairseqTask):
                     else:
                         raise FileNotFoundError('Dataset not found: {} ({})'.format(split, data_path))
 
-                src_datasets.append(indexed_dataset(prefix + src, self.src_dict))
-                tgt_datasets.append(indexed_dataset(prefix + tgt, self.tgt_dict))
-
-                print('| {} {} {} examples'.format(data_path, split_k, len(src_datasets[-1])))
+                shards.append((data_path, split_k, prefix))
 
                 if not combine:
                     break
 
+        def load_shard(shard):
+            prefix = shard[2]
+            return indexed_dataset(prefix + src, self.src_dict), indexed_dataset(prefix + tgt, self.tgt_dict)
 
+        # opening a shard is mostly waiting on file I/O, so on a network file
+        # system it pays to open all of them at once
+        if len(shards) > 1:
+            with ThreadPool(min(len(shards), 16)) as pool:
+                pairs = pool.map(load_shard, shards)
+        else:
+            pairs = [load_shard(shard) for shard in shards]
 
+        src_datasets = [src_ds for src_ds, _ in pairs]
+        tgt_datasets = [tgt_ds for _, tgt_ds in pairs]
+        for (data_path, split_k, _), src_ds in zip(shards, src_datasets):
+            print('| {} {} {} examples'.format(data_path, split_k, len(src_ds)))
 
         assert len(src_datasets) == len(tgt_datasets)
 
@@ -38,6 +38,12 @@ class Trainer(object):
         self.args = args
         self.task = task
 
+        if args.bf16:
+            if args.fp16:
+                raise ValueError('--bf16 and --fp16 are mutually exclusive')
+            if not hasattr(torch, 'autocast'):
+                raise NotImplementedError('--bf16 requires a newer version of PyTorch')
+
         # copy model and criterion to current device
         self.criterion = criterion.cuda()
         if args.fp16:
@@ -176,23 +182,25 @@ class Trainer(object):
             else:
                 ignore_grad = False
 
-            try:
-                # forward
-                loss, sample_size, logging_output = self.task.get_loss(
-                    self.model, self.criterion, sample,
-                )
-                if ignore_grad:
-                    loss *= 0
-
-                if self.args.distributed_world_size > 1:
-                    # only all-reduce gradients in the last backwards pass
-                    if i < len(samples) - 1:
-                        self.model.need_reduction = False
-                    else:
-                        self.model.need_reduction = True
+            if self.args.distributed_world_size > 1 and i < len(samples) - 1:
+                # only all-reduce gradients in the last backwards pass; the
+                # final one overlaps the all-reduce with the backward pass
+                sync_context = self.model.no_sync()
+            else:
+                sync_context = contextlib.ExitStack()
 
-                # backward
-                self.optimizer.backward(loss)
+            try:
+                with sync_context:
+                    # forward
+                    with self._autocast():
+                        loss, sample_size, logging_output = self.task.get_loss(
+                            self.model, self.criterion, sample,
+                        )
+                    if ignore_grad:
+                        loss *= 0
+
+                    # backward
+                    self.optimizer.backward(loss)
 
                 if not ignore_grad:
                     logging_outputs.append(logging_output)
@@ -293,9 +301,10 @@ class Trainer(object):
                 ignore_results = False
 
             try:
-                _loss, sample_size, logging_output = self.task.get_loss(
-                    self.model, self.criterion, sample,
-                )
+                with self._autocast():
+                    _loss, sample_size, logging_output = self.task.get_loss(
+                        self.model, self.criterion, sample,
+                    )
             except RuntimeError as e:
                 if 'out of memory' in str(e) and not raise_oom:
                     print('| WARNING: ran out of memory, retrying batch')
@@ -374,6 +383,11 @@ class Trainer(object):
         """Get the number of parameters updates."""
         return self._num_updates
 
+    def _autocast(self):
+        if self.args.bf16:
+            return torch.autocast('cuda', dtype=torch.bfloat16)
+        return contextlib.ExitStack()
+
     def _prepare_sample(self, sample):
         if sample is None or len(sample) == 0:
             return None
@@ -346,7 +346,9 @@ def make_positions(tensor, padding_idx, left_pad, onnx_trace=False):
     positions = make_positions.range_buf[:tensor.size(1)].expand_as(tensor)
     if left_pad:
         positions = positions - mask.size(1) + mask.long().sum(dim=1).unsqueeze(1)
-    return tensor.clone().masked_scatter_(mask, positions[mask])
+    # padding symbols keep their value; selecting elementwise avoids the
+    # boolean indexing, which would wait for the device to count the mask
+    return torch.where(mask, positions, tensor)
 
 
 def strip_pad(tensor, pad):
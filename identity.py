@@ -1,30 +1,35 @@
+import pickle
+import re
 import sys
 
 import torch
+from torch.serialization import default_restore_location
+
+LAYER_RE = re.compile(r'^encoder\.layers\.(\d+)\.(.+)$')
 
 
 def main():
-    ckpt = torch.load(sys.argv[1])
+    # keep everything on the host, so that saving does not copy tensors back from the GPU
+    ckpt = torch.load(sys.argv[1], map_location=lambda s, l: default_restore_location(s, 'cpu'))
+    num_layers = ckpt['args'].encoder_layers
+
     lst = []
     for k, v in ckpt['model'].items():
-        k_split = k.split('.')
-        if k_split[0] == 'encoder' and k_split[1] == 'layers':
-            id = int(k_split[2])
-            k_split[2] = str(id + ckpt['args'].encoder_layers)
-            new_k = '.'.join(k_split)
-            lst.append([new_k, v.clone()])
+        m = LAYER_RE.match(k)
+        if m is not None:
+            lst.append(('encoder.layers.{}.{}'.format(int(m.group(1)) + num_layers, m.group(2)), v))
+    # the new layers are freshly initialized, so only the shapes of the
+    # existing ones are needed and nothing is cloned
     for k, v in lst:
-        k_split = k.split('.')
-        if k_split[-2] in ['fc2', 'out_proj']:
-            ckpt['model'][k] = torch.zeros_like(v)
-        elif k_split[-1].endswith('bias'):
-            ckpt['model'][k] = torch.zeros_like(v)
+        module, _, param = k.rpartition('.')
+        if module.endswith(('.fc2', '.out_proj')) or param.endswith('bias'):
+            ckpt['model'][k] = torch.zeros(v.shape, dtype=v.dtype)
         else:
             # Kaiming normal
             std = v.size(0) ** -0.5
-            ckpt['model'][k] = torch.randn_like(v) * std
+            ckpt['model'][k] = torch.empty(v.shape, dtype=v.dtype).normal_(0, std)
     ckpt['args'].encoder_layers *= 2
-    torch.save(ckpt, sys.argv[2])
+    torch.save(ckpt, sys.argv[2], pickle_protocol=pickle.HIGHEST_PROTOCOL)
 
 
 if __name__ == '__main__':
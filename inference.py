@@ -38,8 +38,9 @@ def main(parsed_args):
     print('| {} {} {} examples'.format(args.data, args.gen_subset, len(task.dataset(args.gen_subset))))
 
     # Optimize ensemble for generation and set the source and dest dicts on the model (required by scorer)
+    assert not args.quantize or not use_cuda, '--quantize is only supported with --cpu'
     for model in models:
-        model.make_generation_fast_()
+        model.make_generation_fast_(quantize=args.quantize, bf16=args.bf16)
         if use_cuda:
             model.cuda()
         if args.fp16:
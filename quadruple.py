@@ -1,31 +1,32 @@
-import collections
+import pickle
+import re
 import sys
 
 import torch
+from torch.serialization import default_restore_location
+
+LAYER_RE = re.compile(r'^encoder\.layers\.(\d+)\.(.+)$')
 
 
 def main():
-    ckpt = torch.load(sys.argv[1])
+    # keep everything on the host, so that saving does not copy tensors back from the GPU
+    ckpt = torch.load(sys.argv[1], map_location=lambda s, l: default_restore_location(s, 'cpu'))
+    num_layers = ckpt['args'].encoder_layers
 
     lst = []
     for k, v in ckpt['model'].items():
-        k_split = k.split('.')
-        if k_split[0] == 'encoder' and k_split[1] == 'layers':
-            l_id = int(k_split[2])
-            k_split[2] = str(l_id + ckpt['args'].encoder_layers)
-            new_k = '.'.join(k_split)
-            lst.append([new_k, v.clone()])
-            k_split[2] = str(l_id + ckpt['args'].encoder_layers * 2)
-            new_k = '.'.join(k_split)
-            lst.append([new_k, v.clone()])
-            k_split[2] = str(l_id + ckpt['args'].encoder_layers * 3)
-            new_k = '.'.join(k_split)
-            lst.append([new_k, v.clone()])
+        m = LAYER_RE.match(k)
+        if m is not None:
+            l_id = int(m.group(1))
+            # no copy needed: torch.save writes a shared storage only once, and
+            # load_state_dict copies it into independent parameters
+            for i in range(1, 4):
+                lst.append(('encoder.layers.{}.{}'.format(l_id + num_layers * i, m.group(2)), v))
     for k, v in lst:
         ckpt['model'][k] = v
 
     ckpt['args'].encoder_layers *= 4
-    torch.save(ckpt, sys.argv[2])
+    torch.save(ckpt, sys.argv[2], pickle_protocol=pickle.HIGHEST_PROTOCOL)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,88 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the LICENSE file in
+# the root directory of this source tree. An additional grant of patent rights
+# can be found in the PATENTS file in the same directory.
+
+import unittest
+
+import torch
+import torch.nn as nn
+
+from fairseq.models import FairseqBertModel, FairseqEncoder
+
+import tests.utils as test_utils
+
+
+class OneHotEncoder(FairseqEncoder):
+    """Encoder whose outputs are one-hot encodings of the input tokens."""
+
+    def __init__(self, dictionary):
+        super().__init__(dictionary)
+        self.vocab_size = len(dictionary)
+
+    def forward(self, src_tokens, src_lengths, segment, last_layer_mask=None, return_embedding_out=False):
+        x = torch.eye(self.vocab_size)[src_tokens].transpose(0, 1)  # T x B x V
+        n_masked = int(last_layer_mask.sum()) if last_layer_mask is not None else 0
+        return {
+            'encoder_out': x.new_zeros(src_tokens.size(0) + n_masked, self.vocab_size),
+            'encoder_padding_mask': None,
+            'embedding_out': x,
+        }
+
+
+class TestFairseqBertModel(unittest.TestCase):
+
+    def test_idempotence_rows_match_masked_tokens(self):
+        d = test_utils.dummy_dictionary(vocab_size=10)
+        vocab_size = len(d)
+        model = FairseqBertModel(
+            OneHotEncoder(d), nn.Sequential(), torch.eye(vocab_size), vocab_size,
+            enforce_idempotence=True, padding_idx=d.pad(), mlm_prob=0.5,
+        )
+        src_tokens = torch.LongTensor([
+            [4, 5, 6, 7, 8, 9],
+            [10, 11, 12, 13, d.pad(), d.pad()],
+            [6, 4, 5, d.pad(), d.pad(), d.pad()],
+        ])
+        segment = torch.zeros_like(src_tokens)
+        output_mask = torch.zeros_like(src_tokens)
+
+        torch.manual_seed(1)
+        _, _, mlm_out_0, emb_mask = model(src_tokens, None, segment, output_mask)
+
+        self.assertEqual(mlm_out_0.size(0), int(emb_mask.sum()))
+        self.assertFalse(emb_mask[src_tokens.eq(d.pad())].any())
+        # the rows of mlm_out_0 pair up with the tokens picked by the
+        # transposed mask, which is how the criterion builds its targets
+        self.assertTrue(torch.equal(mlm_out_0.argmax(dim=-1), src_tokens.t()[emb_mask.t()]))
+
+    def test_heads_match_model(self):
+        d = test_utils.dummy_dictionary(vocab_size=10)
+        vocab_size = len(d)
+        torch.manual_seed(0)
+        model = FairseqBertModel(
+            OneHotEncoder(d), nn.Sequential(nn.Linear(vocab_size, vocab_size)),
+            nn.Parameter(torch.randn(vocab_size, vocab_size)), vocab_size,
+        )
+        nn.init.normal_(model.classifier.weight)
+        heads = model.get_heads()
+        encoder_out = torch.randn(3 + 5, vocab_size)  # B sentences, N masked positions
+
+        def check():
+            with torch.no_grad():
+                mlm_out, nsp_out = heads(encoder_out[:3], encoder_out[3:])
+                self.assertTrue(torch.equal(mlm_out, model.mlm(encoder_out, 3)))
+                self.assertTrue(torch.equal(nsp_out, model.nsp(encoder_out, 3)))
+
+        check()
+        # heads taken before quantization follow the quantized projection
+        if hasattr(torch, 'quantization') and hasattr(torch.quantization, 'quantize_dynamic'):
+            model.make_generation_fast_(quantize=True)
+            self.assertIsNot(type(model.output_projection), nn.Linear)
+            check()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the LICENSE file in
+# the root directory of this source tree. An additional grant of patent rights
+# can be found in the PATENTS file in the same directory.
+
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+import torch
+
+from fairseq.data import IndexedInMemoryDataset, IndexedMMapDataset
+from fairseq.data.indexed_dataset import IndexedDatasetBuilder
+
+
+class TestIndexedMMapDataset(unittest.TestCase):
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.data_dir, 'train')
+        builder = IndexedDatasetBuilder(self.path + '.bin')
+        g = torch.Generator().manual_seed(0)
+        for size in [(5,), (1,), (2, 3), (9,), (3, 2, 2)]:
+            builder.add_item(torch.randint(0, 50, size, generator=g))
+        builder.finalize(self.path + '.idx')
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    def _check_items(self, expected, ds):
+        self.assertEqual(len(expected), len(ds))
+        self.assertEqual(list(expected.sizes), list(ds.sizes))
+        self.assertEqual(len(expected.buffer), len(ds.buffer))
+        for i in range(len(expected)):
+            self.assertEqual(expected[i].size(), ds[i].size())
+            self.assertTrue(torch.equal(expected[i], ds[i]))
+
+    def test_matches_in_memory(self):
+        for fix_lua_indexing in [False, True]:
+            expected = IndexedInMemoryDataset(self.path, fix_lua_indexing=fix_lua_indexing)
+            ds = IndexedMMapDataset(self.path, fix_lua_indexing=fix_lua_indexing)
+            self._check_items(expected, ds)
+            self.assertTrue((expected.buffer[2:11] == ds.buffer[2:11]).all())
+
+    def test_pickle(self):
+        for fix_lua_indexing in [False, True]:
+            expected = IndexedInMemoryDataset(self.path, fix_lua_indexing=fix_lua_indexing)
+            ds = IndexedMMapDataset(self.path, fix_lua_indexing=fix_lua_indexing)
+            ds[0]  # map the file before pickling
+            self._check_items(expected, pickle.loads(pickle.dumps(ds)))
+
+
+if __name__ == '__main__':
+    unittest.main()
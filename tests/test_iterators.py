@@ -7,9 +7,35 @@
 
 import unittest
 
+import torch
+
 from fairseq.data import iterators
 
 
+class IdentityDataset(torch.utils.data.Dataset):
+
+    offset = 0
+
+    def __getitem__(self, index):
+        return index + self.offset
+
+    def __len__(self):
+        return 20
+
+
+def collate(samples):
+    return samples
+
+
+BATCHES = [[0, 1, 2], [3, 4], [5, 6, 7, 8], [9], [10, 11], [12, 13, 14], [15, 16, 17, 18, 19]]
+
+
+def epoch_batch_iterator(**kwargs):
+    return iterators.EpochBatchIterator(
+        dataset=IdentityDataset(), collate_fn=collate, batch_sampler=BATCHES, **kwargs
+    )
+
+
 class TestIterators(unittest.TestCase):
 
     def test_counting_iterator(self):
@@ -24,6 +50,75 @@ class TestIterators(unittest.TestCase):
         self.assertEqual(next(itr), 9)
         self.assertFalse(itr.has_next())
 
+    def test_epoch_batch_iterator(self):
+        epoch_itr = epoch_batch_iterator()
+        self.assertEqual(len(epoch_itr), len(BATCHES))
+        self.assertEqual(list(epoch_itr.next_epoch_itr(shuffle=False)), BATCHES)
+        self.assertTrue(epoch_itr.end_of_epoch())
+        # shuffled epochs contain every batch once, in an order that depends
+        # on the epoch
+        epoch2 = list(epoch_itr.next_epoch_itr(shuffle=True))
+        epoch3 = list(epoch_itr.next_epoch_itr(shuffle=True))
+        self.assertEqual(sorted(epoch2), sorted(BATCHES))
+        self.assertEqual(sorted(epoch3), sorted(BATCHES))
+        self.assertNotEqual(epoch2, epoch3)
+
+    def test_epoch_batch_iterator_sharded(self):
+        shards = [
+            list(epoch_batch_iterator(num_shards=2, shard_id=i).next_epoch_itr(shuffle=False))
+            for i in range(2)
+        ]
+        # both shards get the same number of batches; the shorter one is
+        # padded with an empty batch
+        self.assertEqual(len(shards[0]), 4)
+        self.assertEqual(len(shards[1]), 4)
+        self.assertEqual(shards[0], BATCHES[0::2])
+        self.assertEqual(shards[1], BATCHES[1::2] + [[]])
+
+    def _check_resume(self, **kwargs):
+        expected = list(epoch_batch_iterator(**kwargs).next_epoch_itr())
+        epoch_itr = epoch_batch_iterator(**kwargs)
+        orig_itr = epoch_itr.next_epoch_itr()
+        consumed = [next(orig_itr) for _ in range(3)]
+        self.assertEqual(consumed, expected[:3])
+        state = epoch_itr.state_dict()
+        self.assertEqual(state, {'epoch': 1, 'iterations_in_epoch': 3})
+
+        resumed = epoch_batch_iterator(**kwargs)
+        resumed.load_state_dict(state)
+        self.assertEqual(resumed.iterations_in_epoch, 3)
+        itr = resumed.next_epoch_itr()
+        self.assertEqual(resumed.epoch, 1)
+        self.assertEqual(list(itr), expected[3:])
+        self.assertTrue(resumed.end_of_epoch())
+
+        # the epoch after the resumed one matches an uninterrupted run
+        self.assertEqual(list(orig_itr), expected[3:])
+        self.assertEqual(list(resumed.next_epoch_itr()), list(epoch_itr.next_epoch_itr()))
+
+    def test_epoch_batch_iterator_resume(self):
+        self._check_resume()
+        self._check_resume(num_shards=2, shard_id=1)
+
+    def test_epoch_batch_iterator_num_workers(self):
+        epoch_itr = epoch_batch_iterator(num_workers=2)
+        reference = epoch_batch_iterator()
+        for _ in range(3):
+            # the DataLoader is reused across epochs and follows each new order
+            self.assertEqual(list(epoch_itr.next_epoch_itr()), list(reference.next_epoch_itr()))
+        self._check_resume(num_workers=2)
+
+    def test_epoch_batch_iterator_num_workers_see_dataset_updates(self):
+        # the workers are started every epoch, so they pick up changes that
+        # the main process makes to the dataset between epochs
+        epoch_itr = epoch_batch_iterator(num_workers=2)
+        self.assertEqual(list(epoch_itr.next_epoch_itr(shuffle=False)), BATCHES)
+        epoch_itr.dataset.offset = 100
+        self.assertEqual(
+            list(epoch_itr.next_epoch_itr(shuffle=False)),
+            [[i + 100 for i in batch] for batch in BATCHES],
+        )
+
 
 if __name__ == '__main__':
     unittest.main()
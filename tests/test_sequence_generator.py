@@ -149,7 +149,7 @@ class TestSequenceGenerator(unittest.TestCase):
 
     def assertTensorEqual(self, t1, t2):
         self.assertEqual(t1.size(), t2.size(), "size mismatch")
-        self.assertEqual(t1.ne(t2).long().sum(), 0)
+        self.assertTrue(torch.equal(t1, t2))
 
 
 class TestDiverseBeamSearch(unittest.TestCase):
@@ -249,7 +249,7 @@ class TestDiverseBeamSearch(unittest.TestCase):
 
     def assertTensorEqual(self, t1, t2):
         self.assertEqual(t1.size(), t2.size(), "size mismatch")
-        self.assertEqual(t1.ne(t2).long().sum(), 0)
+        self.assertTrue(torch.equal(t1, t2))
 
 
 if __name__ == '__main__':
@@ -108,7 +108,7 @@ class TestSequenceScorer(unittest.TestCase):
 
     def assertTensorEqual(self, t1, t2):
         self.assertEqual(t1.size(), t2.size(), "size mismatch")
-        self.assertEqual(t1.ne(t2).long().sum(), 0)
+        self.assertTrue(torch.equal(t1, t2))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,94 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the LICENSE file in
+# the root directory of this source tree. An additional grant of patent rights
+# can be found in the PATENTS file in the same directory.
+
+import math
+import unittest
+
+import numpy as np
+import torch
+
+from fairseq.data import TokenBlockDataset
+
+
+def reference_slices(sizes, block_size, break_mode, total_size):
+    """The original per-sentence loops that TokenBlockDataset replaced."""
+    slice_indices = []
+    if break_mode is None or break_mode == 'none':
+        for i in range(math.ceil(total_size / block_size)):
+            start = i * block_size
+            slice_indices.append((start, min(start + block_size, total_size)))
+    elif break_mode == 'complete':
+        tok_idx = 0
+        sz_idx = 0
+        curr_size = 0
+        while sz_idx < len(sizes):
+            if curr_size + sizes[sz_idx] <= block_size or curr_size == 0:
+                curr_size += sizes[sz_idx]
+                sz_idx += 1
+            else:
+                slice_indices.append((tok_idx, tok_idx + curr_size))
+                tok_idx += curr_size
+                curr_size = 0
+        if curr_size > 0:
+            slice_indices.append((tok_idx, tok_idx + curr_size))
+    elif break_mode == 'eos':
+        curr = 0
+        for sz in sizes:
+            if sz > 1:
+                slice_indices.append((curr, curr + sz))
+            curr += sz
+    return slice_indices
+
+
+class TestTokenBlockDataset(unittest.TestCase):
+
+    def _check(self, sizes, block_size, break_mode, include_targets):
+        sizes = np.array(sizes, dtype=np.int64)
+        tokens = np.arange(sizes.sum(), dtype=np.int64) + 10
+        eos, pad = 2, 1
+        ds = TokenBlockDataset(
+            tokens, sizes, block_size, pad=pad, eos=eos,
+            break_mode=break_mode, include_targets=include_targets,
+        )
+        expected = reference_slices(sizes.tolist(), block_size, break_mode, len(tokens))
+        self.assertEqual([tuple(s) for s in ds.slice_indices.tolist()], expected)
+        self.assertEqual(ds.sizes.tolist(), [e - s for s, e in expected])
+        self.assertEqual(len(ds), len(expected))
+
+        for i, (s, e) in enumerate(expected):
+            item = ds[i]
+            if not include_targets:
+                self.assertTrue(torch.equal(item, torch.from_numpy(tokens[s:e])))
+                continue
+            source, target, past_target = item
+            self.assertTrue(torch.equal(target, torch.from_numpy(tokens[s:e])))
+            shifted = np.concatenate([[pad, eos], tokens])
+            self.assertTrue(torch.equal(source, torch.from_numpy(shifted[s + 1:e + 1])))
+            if e >= 2:
+                # for a one-token first block the past target slice
+                # tokens[0:e - 2] wraps around, so it is not checked
+                self.assertTrue(torch.equal(past_target, torch.from_numpy(shifted[s:e])))
+
+    def test_examples(self):
+        for break_mode in [None, 'none', 'complete', 'eos']:
+            for include_targets in [False, True]:
+                # a sentence longer than the block, and sentences that fit exactly
+                self._check([3, 9, 2, 2, 4, 1], 4, break_mode, include_targets)
+                # empty sentences at the start, in the middle and at the end
+                self._check([0, 0, 3, 0, 5, 1, 0, 0], 4, break_mode, include_targets)
+
+    def test_random_sizes(self):
+        rng = np.random.RandomState(0)
+        for trial in range(300):
+            sizes = rng.randint(0 if trial % 2 else 1, 12, size=rng.randint(0, 30))
+            block_size = int(rng.choice([1, 5, 16]))
+            for break_mode in ['none', 'complete', 'eos']:
+                self._check(sizes, block_size, break_mode, include_targets=trial % 3 == 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+# Copyright (c) 2017-present, Facebook, Inc.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the LICENSE file in
+# the root directory of this source tree. An additional grant of patent rights
+# can be found in the PATENTS file in the same directory.
+
+import argparse
+import unittest
+
+import torch
+
+from fairseq.models.transformer import TransformerBertModel, base_bert_architecture
+
+import tests.utils as test_utils
+
+
+class DummyTask(object):
+
+    def __init__(self, dictionary):
+        self.dict = dictionary
+
+
+def build_model(dictionary, **kwargs):
+    args = argparse.Namespace(
+        encoder_layers=4, encoder_embed_dim=16, encoder_ffn_embed_dim=32,
+        encoder_attention_heads=2, max_positions=32, share_all_embeddings=False,
+        enforce_idempotence=False, no_normalize_affine=False, act_fn='gelu',
+        **kwargs
+    )
+    base_bert_architecture(args)
+    torch.manual_seed(0)
+    model = TransformerBertModel.build_model(args, DummyTask(dictionary))
+    model.eval()
+    return model
+
+
+class TestTransformerEncoder(unittest.TestCase):
+
+    def setUp(self):
+        self.d = test_utils.dummy_dictionary(vocab_size=20)
+        self.src_tokens = torch.LongTensor([
+            [4, 5, 6, 7, 8, 9, 10],
+            [11, 12, 13, 14, 15, self.d.pad(), self.d.pad()],
+            [6, 4, 5, self.d.pad(), self.d.pad(), self.d.pad(), self.d.pad()],
+        ])
+        self.src_lengths = torch.LongTensor([7, 5, 3])
+        self.segment = torch.zeros_like(self.src_tokens)
+        self.segment[:, :2] = 1
+
+    def encode(self, model):
+        with torch.no_grad():
+            out = model.encoder(self.src_tokens, self.src_lengths, self.segment)
+        # padded positions are not defined to be equal across code paths
+        return out['encoder_out'].transpose(0, 1)[self.src_tokens.ne(self.d.pad())]
+
+    def test_unpad_ffn(self):
+        expected = self.encode(build_model(self.d))
+        self.assertAlmostEqual(expected, self.encode(build_model(self.d, unpad_ffn=True)))
+
+    def test_max_attn_chunk_mb(self):
+        expected = self.encode(build_model(self.d))
+        # small enough to compute the attention one query at a time
+        model = build_model(self.d, max_attn_chunk_mb=1e-6)
+        self.assertAlmostEqual(expected, self.encode(model))
+
+    def test_tied_encoder_layers(self):
+        tied = build_model(self.d, tied_encoder_layers=2)
+        layers = tied.encoder.layers
+        self.assertIs(layers[0], layers[2])
+        self.assertIs(layers[1], layers[3])
+        self.assertIsNot(layers[0], layers[1])
+
+        # the state dict has the same keys as an untied model, so the
+        # checkpoint loads into one and gives the same outputs
+        untied = build_model(self.d)
+        self.assertEqual(sorted(tied.state_dict().keys()), sorted(untied.state_dict().keys()))
+        untied.load_state_dict(tied.state_dict())
+        self.assertAlmostEqual(self.encode(tied), self.encode(untied))
+
+    def test_tied_encoder_layers_divisible(self):
+        with self.assertRaises(ValueError):
+            build_model(self.d, tied_encoder_layers=3)
+
+    def assertAlmostEqual(self, t1, t2):
+        self.assertEqual(t1.size(), t2.size(), "size mismatch")
+        self.assertLess((t1 - t2).abs().max(), 1e-5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -71,6 +71,7 @@ def main(args):
         seed=args.seed,
         num_shards=args.distributed_world_size,
         shard_id=args.distributed_rank,
+        num_workers=args.num_workers,
     )
 
     # Load bert model if one is available
@@ -103,6 +104,7 @@ def main(args):
                 seed=args.seed + epoch_itr.epoch,
                 num_shards=args.distributed_world_size,
                 shard_id=args.distributed_rank,
+                num_workers=args.num_workers,
             )
             epoch_itr.load_state_dict(epoch_itr_state)
         train(args, trainer, task, epoch_itr)
@@ -227,6 +229,7 @@ def validate(args, trainer, task, epoch_itr, subsets):
             seed=args.seed,
             num_shards=args.distributed_world_size,
             shard_id=args.distributed_rank,
+            num_workers=args.num_workers,
         ).next_epoch_itr(shuffle=False)
         progress = progress_bar.build_progress_bar(
             args, itr, epoch_itr.epoch,